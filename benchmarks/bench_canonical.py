@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Benchmark canonical.canonicalize_links against per-link clean_url calls.
+
+The legacy path is what the crawler did for every href: clean_url against
+the page URL, check_protocol, then clean_url and remove_protocol again to
+get the key it checked crawled pages against.
+
+Usage: python benchmarks/bench_canonical.py [NUM_HREFS]
+"""
+
+from __future__ import print_function
+import sys
+import time
+
+from scrape import utils
+from scrape.canonical import canonicalize_links
+
+BASE_URL = "http://www.example.com/section/index"
+SAMPLE_HREFS = (
+    "/page{0}.html",
+    "page{0}.html?b=2&a=1",
+    "http://www.example.com/page{0}.html#top",
+    "https://other.org/articles/{0}/",
+    "#section{0}",
+    "mailto:user{0}@example.com",
+)
+
+
+def legacy_canonicalize_links(hrefs, base_url):
+    links = [utils.clean_url(u, base_url) for u in hrefs]
+    links = [x for x in links if utils.check_protocol(x)]
+    return [(x, utils.remove_protocol(utils.clean_url(x))) for x in links]
+
+
+def make_hrefs(num_hrefs):
+    return [SAMPLE_HREFS[i % len(SAMPLE_HREFS)].format(i) for i in range(num_hrefs)]
+
+
+def links_per_second(func, hrefs):
+    start = time.time()
+    func(hrefs, BASE_URL)
+    return len(hrefs) / (time.time() - start)
+
+
+def main():
+    num_hrefs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    hrefs = make_hrefs(num_hrefs)
+    print("{0} hrefs:".format(num_hrefs))
+    print(
+        "  legacy clean_url:     {0:10.0f} links/s".format(
+            links_per_second(legacy_canonicalize_links, hrefs)
+        )
+    )
+    print(
+        "  canonicalize_links:   {0:10.0f} links/s".format(
+            links_per_second(canonicalize_links, hrefs)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Benchmark peak memory and throughput of crawl frontiers.
+
+NUM_URLS links are queued, with every link queued twice to exercise
+deduplication, and then popped. The legacy frontier is the OrderedSet of
+links plus the set of crawled URLs that Crawler.crawl_links used to
+keep. Each frontier runs in a fresh process so that its peak RSS can be
+reported.
+
+Usage: python benchmarks/bench_frontier.py [NUM_URLS]
+"""
+
+from __future__ import print_function
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from scrape.frontier import MemoryFrontier, SQLiteFrontier
+from scrape.orderedset import OrderedSet
+
+
+class LegacyFrontier(object):
+    def __init__(self):
+        self.uncrawled_links = OrderedSet()
+        self.crawled_links = set()
+
+    def __len__(self):
+        return len(self.uncrawled_links)
+
+    def update(self, links):
+        for link in links:
+            if link[1] not in self.crawled_links:
+                self.uncrawled_links.add(link)
+
+    def pop(self):
+        link = self.uncrawled_links.pop(last=False)
+        self.crawled_links.add(link[1])
+        return link
+
+    def close(self):
+        pass
+
+
+FRONTIERS = {
+    "legacy": LegacyFrontier,
+    "memory": MemoryFrontier,
+    "sqlite": SQLiteFrontier,
+}
+
+
+def iter_links(num_urls):
+    for i in range(num_urls):
+        url = "http://example.com/section{0}/page{1}.html".format(i % 100, i)
+        yield url, url[len("http://") :]
+
+
+def run_frontier(name, num_urls):
+    """Fill and drain a frontier in this process and print its statistics."""
+    frontier = FRONTIERS[name]()
+    start = time.time()
+    frontier.update(iter_links(num_urls))
+    frontier.update(iter_links(num_urls))
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    while frontier:
+        frontier.pop()
+    elapsed = time.time() - start
+    frontier.close()
+    print(peak_mb, elapsed)
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] in FRONTIERS:
+        run_frontier(sys.argv[1], int(sys.argv[2]))
+        return
+
+    num_urls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    print("{0} URLs:".format(num_urls))
+    for name in FRONTIERS:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), name, str(num_urls)]
+        )
+        peak_mb, elapsed = output.split()
+        print(
+            "  {0:8} {1:8.1f} MB peak RSS {2:8.2f}s".format(
+                name, float(peak_mb), float(elapsed)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
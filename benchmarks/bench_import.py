@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""Benchmark the time to import scrape.scrape, as scrape -v and --help do.
+
+Each run imports scrape.scrape in a fresh interpreter. The time of an
+interpreter that imports nothing is subtracted, and the fastest of
+NUM_RUNS runs is reported.
+
+Usage: python benchmarks/bench_import.py [NUM_RUNS]
+"""
+
+from __future__ import print_function
+import os
+import subprocess
+import sys
+import time
+
+import scrape
+
+
+def time_python(code, env):
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c", code], env=env)
+    return time.time() - start
+
+
+def main():
+    num_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(scrape.__file__))
+
+    baseline = min(time_python("pass", env) for _ in range(num_runs))
+    fastest = min(time_python("import scrape.scrape", env) for _ in range(num_runs))
+    print(
+        "import scrape.scrape: {0:.1f} ms (best of {1})".format(
+            (fastest - baseline) * 1000, num_runs
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
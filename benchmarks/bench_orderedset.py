@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Benchmark orderedset.OrderedSet against the linked-list OrderedSet it replaced.
+
+Measures the memory held by a set of NUM_KEYS URLs, and the time taken
+to fill it with update, drain it with pop(last=False), and clear it.
+
+Usage: python benchmarks/bench_orderedset.py [NUM_KEYS]
+"""
+
+from __future__ import print_function
+from collections.abc import MutableSet
+import sys
+import time
+import tracemalloc
+
+from scrape.orderedset import OrderedSet
+
+
+class LegacyOrderedSet(MutableSet):
+    """The doubly linked list OrderedSet recipe used before"""
+
+    def __init__(self, iterable=None):
+        self.end = end = []
+        end += [None, end, end]  # sentinel node for doubly linked list
+        self.map = {}  # key --> [key, prev, next]
+        if iterable is not None:
+            self |= iterable
+
+    def __len__(self):
+        return len(self.map)
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def add(self, key):
+        if key not in self.map:
+            end = self.end
+            curr = end[1]
+            curr[2] = end[1] = self.map[key] = [key, curr, end]
+
+    def update(self, iterable):
+        for item in iterable:
+            self.add(item)
+
+    def discard(self, key):
+        if key in self.map:
+            key, prev, next = self.map.pop(key)
+            prev[2] = next
+            next[1] = prev
+
+    def __iter__(self):
+        end = self.end
+        curr = end[2]
+        while curr is not end:
+            yield curr[0]
+            curr = curr[2]
+
+    def pop(self, last=True):
+        if not self:
+            raise KeyError("set is empty")
+        key = self.end[1][0] if last else self.end[2][0]
+        self.discard(key)
+        return key
+
+    def clear(self):
+        while self:
+            self.pop()
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def drain(ordered_set):
+    while ordered_set:
+        ordered_set.pop(last=False)
+
+
+def measure(cls, keys):
+    tracemalloc.start()
+    ordered_set = cls(keys)
+    size_mb = tracemalloc.get_traced_memory()[0] / (1024.0 * 1024.0)
+    tracemalloc.stop()
+    del ordered_set
+
+    ordered_set = cls()
+    fill_time = timed(ordered_set.update, keys)
+    drain_time = timed(drain, ordered_set)
+    ordered_set.update(keys)
+    clear_time = timed(ordered_set.clear)
+    return size_mb, fill_time, drain_time, clear_time
+
+
+def main():
+    num_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    keys = ["example.com/page{0}.html".format(i) for i in range(num_keys)]
+    print("{0} keys:".format(num_keys))
+    for name, cls in (("legacy", LegacyOrderedSet), ("OrderedSet", OrderedSet)):
+        size_mb, fill_time, drain_time, clear_time = measure(cls, keys)
+        print(
+            "  {0:10} {1:7.1f} MB  update {2:6.2f}s  pop(last=False) {3:6.2f}s  "
+            "clear {4:6.2f}s".format(name, size_mb, fill_time, drain_time, clear_time)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Benchmark writing crawled pages as PART.html files against a PageStore.
+
+NUM_PAGES generated pages, a tenth of them duplicates, are written to a
+temporary directory as PART.html files and then to a page store. For
+each, the time to write them, the bytes on disk and the time to read
+them back in random order are reported.
+
+Usage: python benchmarks/bench_pagestore.py [NUM_PAGES]
+"""
+
+from __future__ import print_function
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from scrape.manifest import part_filename
+from scrape.pagestore import PageStore
+
+ROW = "<tr><td>{0}</td><td>GET /index{1}.html 200</td></tr>\n"
+
+
+def make_pages(num_pages):
+    pages = []
+    for i in range(num_pages):
+        num = i if i % 10 else 0  # Every tenth page is a duplicate
+        rows = "".join(ROW.format(num, x) for x in range(200))
+        pages.append("<html><body><table>{0}</table></body></html>".format(rows))
+    return pages
+
+
+def get_disk_size(dirname):
+    return sum(
+        os.path.getsize(os.path.join(root, x))
+        for root, _, files in os.walk(dirname)
+        for x in files
+    )
+
+
+def bench_part_files(dirname, pages, order):
+    start = time.time()
+    for num, page in enumerate(pages, 1):
+        with open(os.path.join(dirname, part_filename(num)), "w") as part_file:
+            part_file.write(page)
+    write_time = time.time() - start
+
+    start = time.time()
+    for num in order:
+        with open(os.path.join(dirname, part_filename(num)), "r") as part_file:
+            part_file.read()
+    return write_time, get_disk_size(dirname), time.time() - start
+
+
+def bench_page_store(dirname, pages, order):
+    start = time.time()
+    store = PageStore(dirname)
+    for num, page in enumerate(pages, 1):
+        store.put(num, "http://example.com/{0}".format(num), page)
+    write_time = time.time() - start
+
+    start = time.time()
+    for num in order:
+        store.get(num)
+    read_time = time.time() - start
+    store.close()
+    return write_time, get_disk_size(dirname), read_time
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    pages = make_pages(num_pages)
+    order = list(range(1, num_pages + 1))
+    random.shuffle(order)
+
+    print("{0} pages:".format(num_pages))
+    benches = (("PART files", bench_part_files), ("page store", bench_page_store))
+    for name, bench in benches:
+        dirname = tempfile.mkdtemp()
+        try:
+            write_time, disk_size, read_time = bench(dirname, pages, order)
+        finally:
+            shutil.rmtree(dirname)
+        print(
+            "  {0:10} write {1:6.2f}s {2:8.1f} MB on disk read {3:6.2f}s".format(
+                name, write_time, disk_size / 1048576.0, read_time
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Benchmark utils.remove_nonprintable against the original per-character join.
+
+Reports throughput in MB of text per second for ASCII-heavy and
+mixed-script lines.
+
+Usage: python benchmarks/bench_printable.py [NUM_MB]
+"""
+
+from __future__ import print_function
+import string
+import sys
+import time
+
+from scrape import utils
+
+
+def legacy_remove_nonprintable(line):
+    """The filter parse_text applied to each line before remove_nonprintable"""
+    return "".join(x for x in line if x in string.printable)
+
+
+def make_lines(num_mb, sample):
+    line = (sample * (200 // len(sample) + 1))[:200]
+    return [line] * (num_mb * 1024 * 1024 // len(line))
+
+
+def throughput(func, lines, *args):
+    size_mb = sum(len(line) for line in lines) / (1024.0 * 1024.0)
+    start = time.time()
+    for line in lines:
+        func(line, *args)
+    return size_mb / (time.time() - start)
+
+
+def main():
+    num_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    corpora = (
+        ("ascii", "The quick brown fox jumps over the lazy dog.\t"),
+        ("mixed", "Crème brûlée — 日本語 text\x07 "),
+    )
+    for name, sample in corpora:
+        lines = make_lines(num_mb, sample)
+        print("{0} text, {1} MB:".format(name, num_mb))
+        print(
+            "  legacy join:           {0:8.1f} MB/s".format(
+                throughput(legacy_remove_nonprintable, lines)
+            )
+        )
+        print(
+            "  remove_nonprintable:   {0:8.1f} MB/s".format(
+                throughput(utils.remove_nonprintable, lines)
+            )
+        )
+        print(
+            "  keep_unicode=True:     {0:8.1f} MB/s".format(
+                throughput(utils.remove_nonprintable, lines, True)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
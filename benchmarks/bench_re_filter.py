@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Benchmark utils.re_filter against the original implementation.
+
+The original rescanned a growing list of matched lines for every line,
+so it is timed on a sample and its rate extrapolated to the full run.
+
+Usage: python benchmarks/bench_re_filter.py [NUM_LINES]
+"""
+
+from __future__ import print_function
+import re
+import sys
+import time
+
+from scrape import utils
+
+REGEXPS = ["error", r"warn(ing)?", r"\bid=\d{5}\b"]
+LEGACY_SAMPLE_SIZE = 20000
+
+
+def legacy_re_filter(text, regexps):
+    """utils.re_filter as it was before RegexFilter"""
+    if not regexps:
+        return text
+
+    matched_text = []
+    compiled_regexps = [re.compile(x) for x in regexps]
+    for line in text:
+        if line in matched_text:
+            continue
+
+        for regexp in compiled_regexps:
+            found = regexp.search(line)
+            if found and found.group():
+                matched_text.append(line)
+
+    return matched_text or text
+
+
+def make_lines(num_lines):
+    """Log-like lines where roughly one in four matches a regexp"""
+    levels = ("info", "debug", "error", "warning")
+    return [
+        "{0} request id={1:05d} took {2}ms".format(levels[i % 4], i % 100000, i % 997)
+        for i in range(num_lines)
+    ]
+
+
+def time_call(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    lines = make_lines(num_lines)
+
+    elapsed = time_call(utils.re_filter, lines, REGEXPS)
+    print(
+        "re_filter:        {0:>9} lines in {1:.2f}s ({2:,.0f} lines/s)".format(
+            num_lines, elapsed, num_lines / elapsed
+        )
+    )
+
+    sample = lines[:LEGACY_SAMPLE_SIZE]
+    elapsed = time_call(legacy_re_filter, sample, REGEXPS)
+    print(
+        "legacy re_filter: {0:>9} lines in {1:.2f}s ({2:,.0f} lines/s, "
+        "slowing as matches accumulate)".format(
+            len(sample), elapsed, len(sample) / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Benchmark peak memory of DOM parsing against incremental parsing.
+
+A generated page of NUM_MB MB (a large table, like a log dump) is
+written to a temporary file. Its text, and the text of the rows matched
+by an XPath, are then extracted from a full DOM and with --stream
+parsing. Each extraction runs in a fresh process so that its peak RSS,
+which includes lxml's own allocations, can be reported.
+
+Usage: python benchmarks/bench_streaming.py [NUM_MB]
+"""
+
+from __future__ import print_function
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from scrape import utils
+
+ROW = '<tr class="{0}"><td>{1}</td><td>GET /index.html 200</td></tr>\n'
+XPATH = "//tr[@class='odd']"
+
+
+def write_page(num_mb):
+    page = tempfile.NamedTemporaryFile("w", suffix=".html", delete=False)
+    with page:
+        page.write("<html><body><table>\n")
+        i = 0
+        while page.tell() < num_mb * 1024 * 1024:
+            page.write(ROW.format("odd" if i % 2 else "even", i))
+            i += 1
+        page.write("</table></body></html>\n")
+    return page.name
+
+
+def dom_text(filename):
+    return utils.parse_text(utils.parse_raw_html(utils.read_files(filename)))
+
+
+def stream_text(filename):
+    with open(filename, "r") as infile:
+        return utils.parse_text_stream(infile)
+
+
+def dom_xpath(filename):
+    html = utils.parse_raw_html(utils.read_files(filename))
+    return utils.clean_text(x for elem in html.xpath(XPATH) for x in elem.itertext())
+
+
+def stream_xpath(filename):
+    with open(filename, "r") as infile:
+        return utils.parse_text_stream(infile, XPATH)
+
+
+MODES = {
+    "dom-text": dom_text,
+    "stream-text": stream_text,
+    "dom-xpath": dom_xpath,
+    "stream-xpath": stream_xpath,
+}
+
+
+def run_mode(mode, filename):
+    """Extract text in this process and print lines, peak RSS MB and time."""
+    start = time.time()
+    lines = len(MODES[mode](filename))
+    elapsed = time.time() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(lines, peak_mb, elapsed)
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] in MODES:
+        run_mode(sys.argv[1], sys.argv[2])
+        return
+
+    num_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    filename = write_page(num_mb)
+    try:
+        print("{0} MB page:".format(num_mb))
+        for mode in MODES:
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), mode, filename]
+            )
+            lines, peak_mb, elapsed = output.split()
+            print(
+                "  {0:14} {1:>8} lines {2:8.1f} MB peak RSS {3:6.2f}s".format(
+                    mode, lines.decode(), float(peak_mb), float(elapsed)
+                )
+            )
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    main()
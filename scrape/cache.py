@@ -0,0 +1,290 @@
+"""A bounded, expiring cache of compressed HTTP responses.
+
+Successful responses to GET requests are stored with their bodies
+compressed by zlib, in a SQLite database or in a directory of files.
+Entries expire after a TTL, and once the cache holds more than its max
+size in compressed bytes, the least recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_TTL = 24 * 60 * 60  # Seconds a response is served from the cache
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+
+class SQLiteBackend(object):
+    """Stores cache entries as rows of a SQLite database."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+            "created REAL, accessed REAL, meta TEXT, body BLOB, size INTEGER)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.size = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        self.accessed = {}  # key --> time it was last used, not yet written
+
+    def get(self, key):
+        """Return (created, meta, body) of a key and mark it used, or None.
+
+        The time it was used is written along with the next change to the
+        database, rather than committed on every hit.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT created, meta, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.accessed[key] = time.time()
+        return row
+
+    def write_accessed(self):
+        """Write the times entries were used since they were last written."""
+        if self.accessed:
+            query = "UPDATE responses SET accessed = ? WHERE key = ?"
+            self.conn.executemany(
+                query, [(accessed, key) for key, accessed in self.accessed.items()]
+            )
+            self.accessed.clear()
+
+    def set(self, key, created, meta, body):
+        with self.lock:
+            self.delete_row(key)
+            self.conn.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, created, created, meta, body, len(body)),
+            )
+            self.size += len(body)
+            self.write_accessed()
+            self.conn.commit()
+
+    def delete_row(self, key):
+        self.accessed.pop(key, None)
+        row = self.conn.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.size -= row[0]
+
+    def delete(self, key):
+        with self.lock:
+            self.delete_row(key)
+            self.write_accessed()
+            self.conn.commit()
+
+    def evict(self, max_bytes):
+        """Delete the least recently used entries until size <= max_bytes."""
+        with self.lock:
+            self.write_accessed()
+            query = "SELECT key, size FROM responses ORDER BY accessed"
+            rows = self.conn.execute(query)
+            evicted = []
+            size = self.size
+            for key, entry_size in rows:
+                if size <= max_bytes:
+                    break
+                evicted.append((key,))
+                size -= entry_size
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self.conn.commit()
+            self.size = size
+        return len(evicted)
+
+    def close(self):
+        with self.lock:
+            self.write_accessed()
+            self.conn.commit()
+            self.conn.close()
+
+
+class FileBackend(object):
+    """Stores cache entries as files in a directory.
+
+    Each file holds a line of JSON with the entry's creation time and
+    metadata, followed by its body. A file's modification time is the
+    time it was last used.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.lock = threading.Lock()
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.size = sum(x.stat().st_size for x in os.scandir(dirname) if x.is_file())
+
+    def get_filename(self, key):
+        key_hash = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.dirname, key_hash)
+
+    def get(self, key):
+        """Return (created, meta, body) of a key and mark it used, or None."""
+        filename = self.get_filename(key)
+        try:
+            with open(filename, "rb") as infile:
+                header = json.loads(infile.readline().decode("utf-8"))
+                body = infile.read()
+            os.utime(filename)
+        except (OSError, IOError, ValueError):
+            return None
+        return header["created"], header["meta"], body
+
+    def set(self, key, created, meta, body):
+        filename = self.get_filename(key)
+        header = json.dumps({"created": created, "meta": meta}).encode("utf-8")
+        tmp_filename = "{0}.{1}.tmp".format(filename, threading.get_ident())
+        with open(tmp_filename, "wb") as outfile:
+            outfile.write(header + b"\n")
+            outfile.write(body)
+            size = outfile.tell()
+        with self.lock:
+            self.size -= self.get_size(filename)
+            os.replace(tmp_filename, filename)
+            self.size += size
+
+    def get_size(self, filename):
+        try:
+            return os.path.getsize(filename)
+        except OSError:
+            return 0
+
+    def delete(self, key):
+        filename = self.get_filename(key)
+        with self.lock:
+            size = self.get_size(filename)
+            if size:
+                os.remove(filename)
+                self.size -= size
+
+    def evict(self, max_bytes):
+        """Delete the least recently used entries until size <= max_bytes."""
+        with self.lock:
+            entries = sorted(
+                (x.stat().st_mtime, x.stat().st_size, x.path)
+                for x in os.scandir(self.dirname)
+                if x.is_file() and not x.name.endswith(".tmp")
+            )
+            num_evicted = 0
+            for _, size, filename in entries:
+                if self.size <= max_bytes:
+                    break
+                os.remove(filename)
+                self.size -= size
+                num_evicted += 1
+        return num_evicted
+
+    def close(self):
+        pass
+
+
+class CacheStats(object):
+    """Counts hits and misses of a ResponseCache and the bytes they saved."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # Response bytes served without a request
+        self.bytes_stored = 0  # Response bytes stored, before compression
+        self.bytes_compressed = 0  # Response bytes stored, after compression
+        self.evicted = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    def __repr__(self):
+        return "{0}(hits={1}, misses={2}, bytes_saved={3}, evicted={4})".format(
+            self.__class__.__name__,
+            self.hits,
+            self.misses,
+            self.bytes_saved,
+            self.evicted,
+        )
+
+
+class ResponseCache(object):
+    """Caches the status, headers and compressed body of GET responses."""
+
+    def __init__(self, backend, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        """Set where responses are stored and how long and how many are kept.
+
+        Keyword arguments:
+        backend -- storage for cache entries (SQLiteBackend or FileBackend)
+        ttl -- seconds before a stored response expires (int)
+        max_bytes -- max compressed bytes stored before evicting (int)
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+    def get(self, key):
+        """Return (status, headers, body) stored for a key, or None if missing."""
+        entry = self.backend.get(key)
+        if entry is not None and time.time() - entry[0] >= self.ttl:
+            self.backend.delete(key)
+            entry = None
+        if entry is None:
+            with self.stats.lock:
+                self.stats.misses += 1
+            return None
+
+        _, meta, body = entry
+        body = zlib.decompress(body)
+        meta = json.loads(meta)
+        with self.stats.lock:
+            self.stats.hits += 1
+            self.stats.bytes_saved += len(body)
+        return meta["status"], meta["headers"], body
+
+    def set(self, key, status, headers, body):
+        """Store a response, evicting old responses if the cache is full."""
+        compressed = zlib.compress(body, COMPRESS_LEVEL)
+        if len(compressed) > self.max_bytes:
+            return
+        meta = json.dumps({"status": status, "headers": dict(headers)})
+        self.backend.set(key, time.time(), meta, compressed)
+        with self.stats.lock:
+            self.stats.bytes_stored += len(body)
+            self.stats.bytes_compressed += len(compressed)
+        if self.backend.size > self.max_bytes:
+            num_evicted = self.backend.evict(self.max_bytes)
+            with self.stats.lock:
+                self.stats.evicted += num_evicted
+
+    def close(self):
+        self.backend.close()
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "filesystem": FileBackend}
+
+
+def open_cache(
+    cache_dir, backend="sqlite", ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES
+):
+    """Open the response cache kept in cache_dir with a backend of BACKENDS."""
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    path = os.path.join(cache_dir, get_cache_filename(backend))
+    return ResponseCache(BACKENDS[backend](path), ttl, max_bytes)
+
+
+def get_cache_filename(backend):
+    """Get the name of the file or directory a backend stores responses in."""
+    return "responses.db" if backend == "sqlite" else "responses"
@@ -0,0 +1,68 @@
+"""Canonical forms of URLs, for fetching and for deduplication.
+
+Each URL is split once to produce both a fetchable URL and a compact
+dedup key. The fetchable URL follows utils.clean_url: internal links are
+resolved against the page they were found on, and www. and fragments
+are removed. The key also drops the scheme and sorts the query, so
+http://www.a.com/x?b=1&a=2 and https://a.com/x?a=2&b=1#top share the
+key a.com/x?a=2&b=1.
+"""
+
+import string
+
+from six.moves.urllib.parse import urljoin, urlsplit, urlunsplit
+
+PROTOCOLS = ("http", "https")
+
+
+def get_join_base(base_url):
+    """Get the base URL that internal links of a page are resolved against.
+
+    The page path is treated as a directory because crawled URLs have
+    their trailing slash stripped.
+    """
+    base = urlsplit(base_url)
+    return "{0}://{1}{2}/".format(base.scheme, base.netloc, base.path)
+
+
+def canonicalize(url, join_base=None):
+    """Return the (fetchable URL, dedup key) of a URL.
+
+    Keyword arguments:
+    url -- the URL or href to canonicalize (str)
+    join_base -- base of internal links, from get_join_base (default: None)
+
+    Return None if the URL is not an http(s) URL.
+    """
+    parts = urlsplit(url)
+    if not parts.netloc and join_base is not None:
+        parts = urlsplit(urljoin(join_base, url))
+    if parts.scheme not in PROTOCOLS or not parts.netloc:
+        return None
+
+    netloc = parts.netloc.replace("www.", "")
+    fetch_url = urlunsplit((parts.scheme, netloc, parts.path, parts.query, ""))
+    fetch_url = fetch_url.rstrip(string.punctuation)
+
+    key = netloc.lower() + parts.path
+    if parts.query:
+        key += "?" + "&".join(sorted(parts.query.split("&")))
+    return fetch_url, key.rstrip(string.punctuation)
+
+
+def canonicalize_links(hrefs, base_url):
+    """Canonicalize the hrefs found on a page, dropping non-http(s) links.
+
+    Keyword arguments:
+    hrefs -- links found on the page (iterable of str)
+    base_url -- the URL of the page (str)
+
+    Return a list of (fetchable URL, dedup key) tuples in href order.
+    """
+    join_base = get_join_base(base_url)
+    links = []
+    for href in hrefs:
+        link = canonicalize(href, join_base)
+        if link is not None:
+            links.append(link)
+    return links
@@ -0,0 +1,52 @@
+"""Crawl state files, which let an interrupted crawl be resumed.
+
+A state file holds everything a Crawler needs to continue a crawl where
+it stopped without fetching any page twice: the frontier, the links
+being fetched when it stopped, the fingerprints of pages already seen
+and the PART.html files already written. It is written next to those
+PART.html files, replacing the previous state atomically.
+A SQLite frontier instead commits the state to its own database, in
+the same transaction as its queue, and the state file only locates it.
+It appends the PART.html files written since the last checkpoint, so
+unlike a memory frontier, a checkpoint costs no more as a crawl grows.
+"""
+
+import hashlib
+import json
+import os
+
+DEFAULT_INTERVAL = 100  # Pages crawled between checkpoints
+
+
+def get_state_filename(seed_url):
+    """Get the name of the state file of a crawl from its seed URL."""
+    seed_hash = hashlib.md5(seed_url.encode("utf-8")).hexdigest()[:12]
+    return "scrape_crawl_{0}.json".format(seed_hash)
+
+
+def get_frontier_filename(state_filename):
+    """Get the name of the SQLite frontier database kept with a state file."""
+    return "{0}.db".format(os.path.splitext(state_filename)[0])
+
+
+def save_state(path, state):
+    """Write a crawl state (dict) to path as JSON, replacing it atomically."""
+    tmp_path = "{0}.tmp".format(path)
+    with open(tmp_path, "w") as outfile:
+        json.dump(state, outfile)
+    os.replace(tmp_path, path)
+
+
+def load_state(path):
+    """Load a crawl state saved by save_state, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as infile:
+        return json.load(infile)
+
+
+def remove_state(path):
+    """Remove a state file and its frontier database, if any."""
+    for filename in (path, get_frontier_filename(path)):
+        if os.path.exists(filename):
+            os.remove(filename)
@@ -1,62 +1,413 @@
 """A class to crawl webpages."""
 
 from __future__ import absolute_import, print_function
+from collections import deque
+import os
+import re
 import sys
+import time
 
-import lxml.html as lh
+from six.moves.urllib.parse import urlparse
 
-from .orderedset import OrderedSet
-from . import utils
+from .canonical import canonicalize, canonicalize_links
+from .frontier import frontier_from_dict, new_frontier
+from .lrucache import LRUCache
+from .robots import DISALLOWED, RobotsCache
+from .scanner import LINK_TAGS, scan_html
+from .simhash import SimHashIndex, simhash
+from .validators import NOT_MODIFIED, Validators, ValidatorStore
+from . import checkpoint, throttle, utils
 
 
 class Crawler(object):
     """Follows and saves webpages to PART.html files."""
 
+    link_tags = LINK_TAGS  # Tags whose hrefs are followed
+    # Links popped ahead per concurrent fetch while waiting on host limits
+    lookahead = 4
+    validators_path = None  # Validator store of --incremental crawls, if not default
+
     def __init__(self, args, seed_url=None):
         """Set seed URL and program arguments"""
         self.seed_url = seed_url
         self.args = args
-        self.page_cache = []
+        self.num_crawled = 0  # Pages saved by the current crawl
+        self.num_unchanged = 0  # Pages skipped by the current crawl as unchanged
+        self.validators = None  # ValidatorStore of an incremental crawl
+        self.response_validators = {}  # unique URL --> (ETag, Last-Modified)
+        self.in_flight = deque()  # (url, unique_url, future) popped, not processed
+        self.start_part_num = 0  # PART.html files written before the crawl
+        self.saved_part_num = 0  # Parts numbered below this are checkpointed
+        self.state_path = None
+        self.checkpoint_interval = args["checkpoint_interval"]
+        if args["resume"] and not self.checkpoint_interval:
+            self.checkpoint_interval = checkpoint.DEFAULT_INTERVAL
+        self.page_cache = LRUCache(args["cache_size"])
+        self.link_filter = None
+        if args["crawl"]:
+            self.link_filter = utils.get_regex_filter(args["crawl"])
+        self.fetch = utils.stream_raw_resp if args["stream"] else utils.get_raw_resp
+        self.scheduler = throttle.HostScheduler(
+            args["rate"], args["host_concurrency"], args["concurrency"]
+        )
+        self.robots = None
+        if args["robots"]:
+            self.robots = RobotsCache(self.scheduler)
+        self.near_dup_index = None
+        if args["near_dup_threshold"] is not None:
+            self.near_dup_index = SimHashIndex(
+                args["near_dup_threshold"], args["cache_size"]
+            )
+
+    def scan_page(self, url, raw_resp):
+        """Get the new links and text of a page in one pass, without a DOM.
+
+        Return a PageScanner whose links are (URL, unique URL) tuples, where
+        the unique URL is the canonical key used to tell whether a page was
+        already crawled.
+        """
+        page = scan_html(raw_resp, link_tags=self.link_tags)
+        page.links = self.get_new_links(url, page.links)
+        return page
 
-    def get_new_links(self, url, resp):
-        """Get new links from a URL and filter them."""
-        links_on_page = resp.xpath("//a/@href")
-        links = [utils.clean_url(u, url) for u in links_on_page]
+    def get_new_links(self, url, hrefs):
+        """Canonicalize the hrefs found on a page and filter them.
 
-        # Remove non-links through filtering by protocol
-        links = [x for x in links if utils.check_protocol(x)]
+        Return a list of (URL, unique URL) tuples.
+        """
+        # Resolve internal links and remove non-links in a single pass
+        links = canonicalize_links(hrefs, url)
 
         # Restrict new URLs by the domain of the input URL
         if not self.args["nonstrict"]:
             domain = utils.get_domain(url)
-            links = [x for x in links if utils.get_domain(x) == domain]
+            links = [x for x in links if utils.get_domain(x[0]) == domain]
 
-        # Filter URLs by regex keywords, if any
-        if self.args["crawl"]:
-            links = utils.re_filter(links, self.args["crawl"])
+        # Filter URLs by regex keywords, keeping every URL if none match
+        if self.link_filter is not None:
+            kept_links = [x for x in links if self.link_filter.match(x[0])]
+            links = kept_links or links
         return links
 
     def limit_reached(self, num_crawls):
         """Check if number of pages crawled have reached a limit."""
         return self.args["max_crawls"] and num_crawls >= self.args["max_crawls"]
 
-    def page_crawled(self, page_resp):
+    def page_crawled(self, page_resp, page_text=None, page_simhash=None):
         """Check if page has been crawled by hashing its text content.
 
+        If a near-duplicate threshold is set, pages whose SimHash is within
+        that many bits of a crawled page also count as crawled. The SimHash
+        is computed from page_text, unless given as page_simhash.
+
         Add new pages to the page cache.
         Return whether page was found in cache.
         """
-        page_text = utils.parse_text(page_resp)
+        if page_text is None:
+            page_text = utils.parse_text(
+                page_resp, keep_unicode=self.args["keep_unicode"]
+            )
         page_hash = utils.hash_text("".join(page_text))
-        if page_hash not in self.page_cache:
-            utils.cache_page(self.page_cache, page_hash, self.args["cache_size"])
+        if self.page_cache.get(page_hash) is not None:
+            return True
+
+        if self.near_dup_index is not None:
+            fingerprint = page_simhash
+            if fingerprint is None:
+                fingerprint = simhash(" ".join(page_text))
+            if self.near_dup_index.find(fingerprint) is not None:
+                return True
+            self.near_dup_index.add(fingerprint)
+
+        utils.cache_page(self.page_cache, page_hash)
+        return False
+
+    def skip_unchanged(self, url, validators, frontier):
+        """Follow the links of an unchanged page without saving it.
+
+        The page still counts as crawled, so later copies of it, or near
+        copies of it if its SimHash is known, are skipped too.
+        """
+        self.num_unchanged += 1
+        utils.cache_page(self.page_cache, validators.fingerprint)
+        if self.near_dup_index is not None and validators.simhash is not None:
+            self.near_dup_index.add(validators.simhash)
+        frontier.update(validators.links)
+        if not self.args["quiet"]:
+            print("Unchanged {0}.".format(url))
+
+    def process_page(self, url, raw_resp, frontier, key=None):
+        """Parse a fetched page, queue its new links and save it to disk.
+
+        Keyword arguments:
+        url -- the URL the page was fetched from (str)
+        raw_resp -- unparsed page content, or None if the fetch failed (str or
+                    file object from utils.stream_raw_resp), or NOT_MODIFIED,
+                    or DISALLOWED if robots.txt disallows the page
+        frontier -- the crawl frontier (MemoryFrontier or SQLiteFrontier)
+        key -- the unique URL of the page (str)
+
+        Return whether the page was saved as a PART.html file.
+        """
+        if raw_resp is NOT_MODIFIED:
+            # Pages the server says are unchanged are not parsed at all, and
+            # fetch_politely only says so for pages with stored validators
+            self.skip_unchanged(url, self.validators.get(key), frontier)
             return False
-        return True
+
+        if raw_resp is DISALLOWED:
+            return False
+
+        if raw_resp is None:
+            if not self.args["quiet"]:
+                sys.stderr.write("Failed to parse {0}.\n".format(url))
+            return False
+
+        try:
+            # Scan the page once for links and text; a DOM is only built later
+            # if the output needs one
+            page = self.scan_page(url, raw_resp)
+            page_text = utils.clean_text(page.text, self.args["keep_unicode"])
+            links = page.links
+            page_simhash = None
+            if self.validators is not None:
+                etag, last_modified = self.response_validators.pop(key, (None, None))
+                fingerprint = utils.hash_text("".join(page_text))
+                if self.near_dup_index is not None:
+                    page_simhash = simhash(" ".join(page_text))
+                validators = Validators(
+                    etag, last_modified, fingerprint, page_simhash, links
+                )
+                old = self.validators.get(key)
+                if old is not None and old.fingerprint == fingerprint:
+                    self.validators.set(key, validators)
+                    self.skip_unchanged(url, validators, frontier)
+                    return False
+            if self.page_crawled(None, page_text, page_simhash):
+                return False
+
+            self.num_crawled += 1
+            frontier.update(links)
+            if not self.args["quiet"]:
+                print("Crawled {0} (#{1}).".format(url, self.num_crawled))
+
+            # Write page response to PART.html file
+            utils.write_part_file(self.args, url, raw_resp, page_text=page_text)
+            if self.validators is not None:
+                # Recorded only once the page is saved, as a page whose
+                # validators are recorded may never be saved again
+                self.validators.set(key, validators)
+            return True
+        finally:
+            if utils.is_stream(raw_resp):
+                raw_resp.close()  # Delete the temporary file
+
+    def fetch_politely(self, url, key=None):
+        """Fetch a page once the rate and concurrency limits of its host allow.
+
+        Return DISALLOWED, without fetching the page, if robots.txt disallows
+        it. In an incremental crawl, return NOT_MODIFIED if the server says
+        the page is unchanged since it was last crawled.
+        """
+        # Checked here rather than as links are queued, as the first check
+        # of each host fetches its robots.txt
+        if self.robots is not None and not self.robots.can_fetch(url):
+            return DISALLOWED
+
+        with self.scheduler.slot(urlparse(url).netloc):
+            if self.validators is None:
+                return self.fetch(url)
+
+            etag = last_modified = None
+            old = self.validators.get(key)
+            if old is not None:
+                etag, last_modified = old.etag, old.last_modified
+            raw_resp, etag, last_modified = utils.get_modified_resp(
+                url, etag, last_modified, self.args["stream"]
+            )
+            if raw_resp is None:
+                if old is not None:
+                    return NOT_MODIFIED
+                # Nothing is stored to reuse, so get the page in full
+                raw_resp = self.fetch(url)
+                etag = last_modified = None
+            self.response_validators[key] = (etag, last_modified)
+            return raw_resp
+
+    @property
+    def window_size(self):
+        """Get the max number of links popped from the frontier at once.
+
+        With per-host limits, fetches to a busy host wait on the scheduler
+        while more links are popped, so other hosts can still be fetched.
+        """
+        if self.args["rate"] or self.args["host_concurrency"]:
+            return self.args["concurrency"] * self.lookahead
+        return self.args["concurrency"]
+
+    @property
+    def num_visited(self):
+        """Get the number of pages saved or skipped as unchanged by the crawl."""
+        return self.num_crawled + self.num_unchanged
+
+    @property
+    def checkpointing(self):
+        """Whether the crawl state is saved so the crawl can be resumed."""
+        return bool(self.checkpoint_interval)
+
+    def save_checkpoint(self, frontier):
+        """Save the state of the current crawl to self.state_path.
+
+        Only the parts written since the last checkpoint are passed to the
+        frontier, which keeps the rest. The page hashes and fingerprints are
+        bounded by args["cache_size"].
+        """
+        manifest = utils.get_manifest()
+        fingerprints = []
+        if self.near_dup_index is not None:
+            fingerprints = list(self.near_dup_index.fingerprints)
+        state = {
+            "seed_url": self.seed_url,
+            "saved_at": time.time(),
+            "num_crawled": self.num_crawled,
+            "num_unchanged": self.num_unchanged,
+            "start_part_num": self.start_part_num,
+            "in_flight": [[url, key] for url, key, _ in self.in_flight],
+            "page_hashes": list(self.page_cache),
+            "fingerprints": fingerprints,
+            "manifest": manifest.to_dict(self.saved_part_num),
+        }
+        if self.validators is not None:
+            self.validators.flush()
+        # The frontier is saved with the rest of the state in one step, so
+        # the two always match even if the process is killed
+        checkpoint.save_state(self.state_path, frontier.save_state(state))
+        self.saved_part_num = manifest.next_num
+
+    def checkpoint_if_due(self, frontier):
+        """Save the crawl state every self.checkpoint_interval pages."""
+        if self.checkpointing and self.num_crawled % self.checkpoint_interval == 0:
+            self.save_checkpoint(frontier)
+
+    def resume(self):
+        """Restore the state saved by save_checkpoint, if any.
+
+        Return the frontier of the saved crawl, or None if there is none.
+        """
+        frontier = None
+        state = checkpoint.load_state(self.state_path)
+        if state is not None:
+            frontier = frontier_from_dict(state["frontier"])
+            state = frontier.load_state(state)
+        if state is None:
+            if frontier is not None:
+                frontier.close()
+            if not self.args["quiet"]:
+                sys.stderr.write("No saved crawl of {0}.\n".format(self.seed_url))
+            return None
+
+        self.num_crawled = state["num_crawled"]
+        self.num_unchanged = state["num_unchanged"]
+        self.start_part_num = state["start_part_num"]
+        self.in_flight.extend((url, key, None) for url, key in state["in_flight"])
+        for page_hash in state["page_hashes"]:
+            utils.cache_page(self.page_cache, page_hash)
+        if self.near_dup_index is not None:
+            for fingerprint in state["fingerprints"]:
+                self.near_dup_index.add(fingerprint)
+        self.remove_unsaved_parts(state["manifest"]["next_num"], state["saved_at"])
+        manifest = utils.get_manifest()
+        manifest.restore(state["manifest"])
+        self.saved_part_num = manifest.next_num
+        if self.args["page_store"] and not self.args["html"]:
+            utils.get_page_store(create=True)  # Holds the pages already saved
+        if not self.args["quiet"]:
+            print(
+                "Resuming crawl of {0} after {1} pages.".format(
+                    self.seed_url, self.num_crawled
+                )
+            )
+        return frontier
+
+    def remove_unsaved_parts(self, next_num, saved_at):
+        """Remove the PART.html files written after the last checkpoint.
+
+        If the crawl was killed rather than interrupted, pages may have been
+        saved after the state was. They are still queued, so they are
+        crawled again on resuming.
+        """
+        for filename in os.listdir(os.getcwd()):
+            match = re.match(r"PART(\d+)\.html$", filename)
+            if (
+                match
+                and int(match.group(1)) >= next_num
+                and os.path.getmtime(filename) >= saved_at
+            ):
+                utils.remove_file(filename)
+                utils.remove_part_images(filename)
+
+    def crawl_serially(self, frontier):
+        """Fetch and process one page at a time from the crawl frontier."""
+        while self.in_flight or frontier:
+            # Check limit on number of links and pages to crawl
+            if self.limit_reached(self.num_visited):
+                break
+            if not self.in_flight:
+                url, key = frontier.pop()
+                self.in_flight.append((url, key, None))
+            url, key, _ = self.in_flight[0]
+            raw_resp = self.fetch_politely(url, key)
+            saved = self.process_page(url, raw_resp, frontier, key)
+            self.in_flight.popleft()
+            if saved:
+                self.checkpoint_if_due(frontier)
+
+    async def crawl_concurrently(self, loop, frontier):
+        """Keep up to args["concurrency"] page fetches in flight at once.
+
+        URLs are popped from the frontier in breadth-first order and their
+        responses are processed in that same order, so pages are numbered
+        exactly as they would be by a serial crawl. Each fetch runs on its
+        own thread, which waits on the scheduler for its host.
+        """
+        in_flight = self.in_flight
+        # Start fetching the links that were in flight when the crawl stopped
+        for _ in range(len(in_flight)):
+            url, key, _ = in_flight.popleft()
+            fetch = loop.run_in_executor(None, self.fetch_politely, url, key)
+            in_flight.append((url, key, fetch))
+        try:
+            while frontier or in_flight:
+                # Fill the window of in-flight fetches from the frontier
+                while (
+                    frontier
+                    and len(in_flight) < self.window_size
+                    and not self.limit_reached(self.num_visited + len(in_flight))
+                ):
+                    url, key = frontier.pop()
+                    fetch = loop.run_in_executor(None, self.fetch_politely, url, key)
+                    in_flight.append((url, key, fetch))
+
+                if not in_flight:
+                    break
+
+                url, key, fetch = in_flight[0]
+                saved = self.process_page(url, await fetch, frontier, key)
+                in_flight.popleft()
+                if saved:
+                    self.checkpoint_if_due(frontier)
+        finally:
+            for _, _, fetch in in_flight:
+                fetch.cancel()
 
     def crawl_links(self, seed_url=None):
         """Find new links given a seed URL and follow them breadth-first.
 
-        Save page responses as PART.html files.
+        Save page responses as PART.html files. If checkpointing, the crawl
+        state is saved periodically and when the crawl is interrupted, and
+        args["resume"] continues the saved crawl of the seed URL. If
+        args["incremental"], pages unchanged since they were last crawled
+        are not saved again.
         Return the PART.html filenames created during crawling.
         """
         if seed_url is not None:
@@ -66,43 +417,69 @@ class Crawler(object):
             sys.stderr.write("Crawling requires a seed URL.\n")
             return []
 
-        prev_part_num = utils.get_num_part_files()
-        crawled_links = set()
-        uncrawled_links = OrderedSet()
+        self.num_crawled = 0
+        self.num_unchanged = 0
+        self.in_flight.clear()
+        self.start_part_num = utils.get_num_part_files()
+        self.saved_part_num = 0
+        frontier = None
+        frontier_path = None
+        if self.checkpointing:
+            self.state_path = os.path.join(
+                os.getcwd(), checkpoint.get_state_filename(self.seed_url)
+            )
+            frontier_path = checkpoint.get_frontier_filename(self.state_path)
+            if self.args["resume"]:
+                frontier = self.resume()
+
+        if frontier is None:
+            # Each unique URL is queued once, so pages are never fetched twice
+            frontier = new_frontier(self.args["frontier"], frontier_path)
+            seed_link = canonicalize(self.seed_url)
+            if seed_link is None:
+                seed_link = (self.seed_url, utils.remove_protocol(self.seed_url))
+            frontier.add(*seed_link)
 
-        uncrawled_links.add(self.seed_url)
+        if self.args["incremental"]:
+            self.validators = ValidatorStore(self.validators_path)
+
+        completed = False
         try:
-            while uncrawled_links:
-                # Check limit on number of links and pages to crawl
-                if self.limit_reached(len(crawled_links)):
-                    break
-                url = uncrawled_links.pop(last=False)
-
-                # Remove protocol, fragments, etc. to get unique URLs
-                unique_url = utils.remove_protocol(utils.clean_url(url))
-                if unique_url not in crawled_links:
-                    raw_resp = utils.get_raw_resp(url)
-                    if raw_resp is None:
-                        if not self.args["quiet"]:
-                            sys.stderr.write("Failed to parse {0}.\n".format(url))
-                        continue
-
-                    resp = lh.fromstring(raw_resp)
-                    if self.page_crawled(resp):
-                        continue
-
-                    crawled_links.add(unique_url)
-                    new_links = self.get_new_links(url, resp)
-                    uncrawled_links.update(new_links)
-                    if not self.args["quiet"]:
-                        print("Crawled {0} (#{1}).".format(url, len(crawled_links)))
-
-                    # Write page response to PART.html file
-                    utils.write_part_file(
-                        self.args, url, raw_resp, resp, len(crawled_links)
-                    )
+            if self.args["concurrency"] > 1:
+                import asyncio
+                from concurrent.futures import ThreadPoolExecutor
+
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(
+                    ThreadPoolExecutor(max_workers=self.window_size)
+                )
+                try:
+                    loop.run_until_complete(self.crawl_concurrently(loop, frontier))
+                finally:
+                    loop.close()
+            else:
+                self.crawl_serially(frontier)
+            completed = True
         except (KeyboardInterrupt, EOFError):
-            pass
+            if self.checkpointing:
+                raise  # Convert the pages once the crawl is resumed
+            completed = True
+        finally:
+            if self.checkpointing and not completed:
+                self.save_checkpoint(frontier)
+                sys.stderr.write(
+                    "Saved crawl of {0}, use --resume to continue it.\n".format(
+                        self.seed_url
+                    )
+                )
+            frontier.close()
+            if self.validators is not None:
+                self.validators.close()
+                self.validators = None
 
+        if self.args["incremental"] and not self.args["quiet"]:
+            print("Skipped {0} unchanged pages.".format(self.num_unchanged))
+        if self.checkpointing:
+            checkpoint.remove_state(self.state_path)
         curr_part_num = utils.get_num_part_files()
-        return utils.get_part_filenames(curr_part_num, prev_part_num)
+        return utils.get_part_filenames(curr_part_num, self.start_part_num)
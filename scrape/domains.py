@@ -0,0 +1,57 @@
+"""Memoized, offline extraction of domains and suffixes from URLs."""
+
+from __future__ import absolute_import
+
+from six.moves.urllib.parse import urlsplit
+
+from .lrucache import LRUCache
+
+DEFAULT_CACHE_SIZE = 10000
+
+
+def get_netloc(url):
+    """Get the lowercase network location of a URL, with or without a scheme."""
+    if "//" not in url:
+        url = "//" + url
+    return urlsplit(url).netloc.lower()
+
+
+class DomainExtractor(object):
+    """Splits URLs into subdomain, domain and suffix using tldextract.
+
+    Only the public suffix list snapshot bundled with tldextract is used,
+    never one downloaded to its cache, so extraction never touches the
+    network. Results are cached by netloc, since every URL on a host
+    shares the same domain and suffix.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.tldextract = None  # Created on first use, as importing it is slow
+        self.cache = LRUCache(cache_size)
+
+    def extract(self, url):
+        """Return the tldextract.ExtractResult of a URL."""
+        netloc = get_netloc(url)
+        result = self.cache.get(netloc)
+        if result is None:
+            if self.tldextract is None:
+                import tldextract
+
+                self.tldextract = tldextract.TLDExtract(
+                    cache_dir=None, suffix_list_urls=()
+                )
+            result = self.tldextract(netloc)
+            self.cache[netloc] = result
+        return result
+
+    def domain(self, url):
+        return self.extract(url).domain
+
+    def suffix(self, url):
+        return self.extract(url).suffix
+
+    @property
+    def hit_rate(self):
+        """Fraction of extractions answered from the cache."""
+        lookups = self.cache.hits + self.cache.misses
+        return self.cache.hits / float(lookups) if lookups else 0.0
@@ -0,0 +1,267 @@
+"""Crawl frontiers: FIFO queues of links that remember every link queued.
+
+A link is a (URL, unique URL) tuple from canonical.canonicalize. Each
+unique URL is queued at most once per crawl, so the frontier also acts
+as the record of visited pages and no separate set of crawled URLs is
+needed. MemoryFrontier keeps everything in memory; SQLiteFrontier keeps
+the queue and the unique URLs in a SQLite database on disk, so crawls of
+millions of URLs are not limited by RAM.
+"""
+
+from collections import deque
+import json
+import os
+import sqlite3
+import tempfile
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+class MemoryFrontier(object):
+    """A frontier held in a deque plus a set of the unique URLs seen."""
+
+    def __init__(self):
+        self.queue = deque()
+        self.seen = set()
+        self.parts = []  # Manifest entries of the crawl states saved so far
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __contains__(self, key):
+        """Return whether a unique URL has ever been queued."""
+        return key in self.seen
+
+    def add(self, url, key):
+        """Queue a link unless its unique URL was seen, returning if queued."""
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.queue.append((url, key))
+        return True
+
+    def update(self, links):
+        for url, key in links:
+            self.add(url, key)
+
+    def pop(self):
+        """Remove and return the oldest queued link, raising IndexError if empty."""
+        return self.queue.popleft()
+
+    def to_dict(self):
+        """Return the state of the frontier, for from_dict."""
+        return {"kind": "memory", "queue": list(self.queue), "seen": list(self.seen)}
+
+    @classmethod
+    def from_dict(cls, state):
+        frontier = cls()
+        frontier.queue.extend(tuple(link) for link in state["queue"])
+        frontier.seen.update(state["seen"])
+        return frontier
+
+    def save_state(self, state):
+        """Return a crawl state (dict) with the frontier in it, to save.
+
+        The manifest of the state only holds the parts written since the
+        last call, which are added to the parts saved before them. The
+        whole queue and every part are returned, so the cost of saving
+        grows with the crawl.
+        """
+        self.parts.extend(state["manifest"]["parts"])
+        manifest = dict(state["manifest"], parts=self.parts)
+        return dict(state, manifest=manifest, frontier=self.to_dict())
+
+    def load_state(self, state):
+        """Return the crawl state saved with the frontier by save_state."""
+        self.parts = list(state["manifest"]["parts"])
+        return state
+
+    def close(self):
+        pass
+
+
+class SQLiteFrontier(object):
+    """A frontier kept in a SQLite database on disk.
+
+    Links are queued in a table ordered by insertion, and unique URLs
+    in a second table keyed by URL. New links are buffered in memory and
+    written batch_size at a time, and links are read back in batches of
+    the same size, so the database is touched once per batch. While the
+    queue fits in one batch it never leaves memory at all.
+
+    A frontier in a named file only commits its changes when flushed, so
+    if the process is killed it reopens as it was at the last flush.
+    """
+
+    def __init__(self, path=None, batch_size=DEFAULT_BATCH_SIZE):
+        """Open or create a frontier database.
+
+        Keyword arguments:
+        path -- database filename, or None for a temporary file (str)
+        batch_size -- links read or written at a time (int)
+        """
+        self.temporary = path is None
+        if self.temporary:
+            handle, path = tempfile.mkstemp(prefix="scrape-frontier-", suffix=".db")
+            os.close(handle)
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        if self.temporary:
+            self.conn.execute("PRAGMA journal_mode = OFF")
+            self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue "
+            "(seq INTEGER PRIMARY KEY, url TEXT, key TEXT)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (state TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS parts "
+            "(num INTEGER PRIMARY KEY, url TEXT, size INTEGER)"
+        )
+        self.head = deque()  # (seq, URL, unique URL) of the oldest links
+        self.tail = deque()  # Newest links, not yet written to the database
+        self.last_popped = None  # seq of the last link popped from head
+        self.num_stored = self.conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+    def __len__(self):
+        return len(self.head) + self.num_stored + len(self.tail)
+
+    def __contains__(self, key):
+        """Return whether a unique URL has ever been queued."""
+        query = "SELECT 1 FROM seen WHERE key = ?"
+        return self.conn.execute(query, (key,)).fetchone() is not None
+
+    def add(self, url, key):
+        """Queue a link unless its unique URL was seen, returning if queued."""
+        cursor = self.conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (key,))
+        if not cursor.rowcount:
+            return False
+        self.tail.append((url, key))
+        if len(self.tail) >= self.batch_size:
+            self.write_tail()
+        return True
+
+    def update(self, links):
+        for url, key in links:
+            self.add(url, key)
+
+    def pop(self):
+        """Remove and return the oldest queued link, raising IndexError if empty."""
+        if not self.head:
+            if self.num_stored:
+                self.read_head()
+            elif self.tail:
+                return self.tail.popleft()  # Everything queued is in memory
+        seq, url, key = self.head.popleft()
+        self.last_popped = seq
+        return url, key
+
+    def write_tail(self):
+        """Append the buffered newest links to the queue table."""
+        self.conn.executemany("INSERT INTO queue (url, key) VALUES (?, ?)", self.tail)
+        if self.temporary:
+            self.conn.commit()
+        self.num_stored += len(self.tail)
+        self.tail.clear()
+
+    def delete_popped(self):
+        """Delete the links popped so far from the queue table."""
+        if self.last_popped is not None:
+            self.conn.execute("DELETE FROM queue WHERE seq <= ?", (self.last_popped,))
+            self.last_popped = None
+
+    def read_head(self):
+        """Read the oldest batch of links that were not popped from the queue table.
+
+        Rows stay in the table until they are popped, so a flushed database
+        holds exactly the links still queued.
+        """
+        self.delete_popped()
+        rows = self.conn.execute(
+            "SELECT seq, url, key FROM queue ORDER BY seq LIMIT ?", (self.batch_size,)
+        ).fetchall()
+        if self.temporary:
+            self.conn.commit()
+        self.num_stored -= len(rows)
+        self.head.extend(rows)
+
+    def flush(self):
+        """Write every buffered link to the database."""
+        if self.tail:
+            self.write_tail()
+        self.delete_popped()
+        self.conn.commit()
+
+    def to_dict(self):
+        """Flush the frontier and return its state, for from_dict."""
+        self.flush()
+        return {"kind": "sqlite", "path": self.path}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["path"])
+
+    def save_state(self, state):
+        """Commit a crawl state (dict) with the frontier, in one transaction.
+
+        The manifest of the state only holds the parts written since the
+        last call, which are appended to a table, so like the queue, only
+        what changed is written.
+
+        Return the state to save in its place, which only locates the frontier.
+        """
+        manifest = state["manifest"]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO parts VALUES (?, ?, ?)",
+            [(part["num"], part["url"], part["size"]) for part in manifest["parts"]],
+        )
+        state = dict(state, manifest=dict(manifest, parts=[]))
+        self.conn.execute("DELETE FROM state")
+        self.conn.execute("INSERT INTO state VALUES (?)", (json.dumps(state),))
+        self.flush()
+        return {"frontier": self.to_dict()}
+
+    def load_state(self, state):
+        """Return the crawl state committed by save_state, or None."""
+        row = self.conn.execute("SELECT state FROM state").fetchone()
+        if row is None:
+            return None
+        saved_state = json.loads(row[0])
+        rows = self.conn.execute("SELECT num, url, size FROM parts ORDER BY num")
+        saved_state["manifest"]["parts"] = [
+            {"num": num, "url": url, "size": size} for num, url, size in rows
+        ]
+        return dict(saved_state, frontier=state["frontier"])
+
+    def close(self):
+        """Close the database, deleting it if it is a temporary file."""
+        if not self.temporary:
+            self.flush()
+        self.conn.close()
+        if self.temporary and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+FRONTIERS = {"memory": MemoryFrontier, "sqlite": SQLiteFrontier}
+
+
+def new_frontier(kind="memory", path=None):
+    """Create an empty frontier of the given kind (a key of FRONTIERS).
+
+    A SQLite frontier is kept in the database at path, if given, which
+    is emptied first; otherwise it is kept in a temporary file.
+    """
+    if kind == "sqlite":
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        return SQLiteFrontier(path)
+    return FRONTIERS[kind]()
+
+
+def frontier_from_dict(state):
+    """Recreate a frontier from the state returned by its to_dict method."""
+    return FRONTIERS[state["kind"]].from_dict(state)
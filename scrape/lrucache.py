@@ -0,0 +1,58 @@
+"""A bounded mapping that evicts its least recently used entries."""
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """An OrderedDict-backed LRU cache with O(1) lookup, insertion and eviction.
+
+    Lookups through get() count toward hits and misses, while `in` only
+    checks membership and leaves both the counters and recency untouched.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def get(self, key, default=None):
+        """Return the value of key, marking it as most recently used."""
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.data:
+            self.data.move_to_end(key)
+        self.data[key] = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+
+    def __repr__(self):
+        return "{0}(maxsize={1}, hits={2}, misses={3}, evictions={4})".format(
+            self.__class__.__name__,
+            self.maxsize,
+            self.hits,
+            self.misses,
+            self.evictions,
+        )
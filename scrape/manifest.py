@@ -0,0 +1,115 @@
+"""An in-memory record of the PART.html files written during a run."""
+
+from __future__ import absolute_import
+from collections import OrderedDict
+from itertools import islice
+import os
+
+
+def part_filename(num):
+    """Get the filename of a PART.html file from its number."""
+    return "PART{0}.html".format(num)
+
+
+class Part(object):
+    """A page saved as a PART.html file, or kept in memory as text."""
+
+    __slots__ = ("num", "filename", "url", "size", "text")
+
+    def __init__(self, num, url=None, size=0, text=None):
+        self.num = num
+        self.filename = part_filename(num)
+        self.url = url
+        self.size = size  # Bytes written to disk, or characters of text
+        self.text = text  # Parsed text if kept in memory, otherwise None
+
+    @property
+    def in_memory(self):
+        return self.text is not None
+
+    def to_dict(self):
+        return {"num": self.num, "url": self.url, "size": self.size}
+
+
+class PartManifest(object):
+    """Tracks the PART.html files of one directory, in the order written.
+
+    PART helpers consult the manifest rather than listing the directory,
+    so counting parts is O(1) and unrelated PART.html files are ignored
+    (and never overwritten).
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.parts = OrderedDict()  # filename --> Part, in the order written
+        self.next_num = 1
+        self.text_size = 0  # Characters of text held by in-memory parts
+
+    def __len__(self):
+        return len(self.parts)
+
+    def __iter__(self):
+        return iter(self.parts.values())
+
+    def get(self, filename):
+        """Return the Part with the given filename, or None."""
+        return self.parts.get(filename)
+
+    def new_part(self, url=None, num=None):
+        """Record a new part and return it.
+
+        The part number defaults to the next number whose file neither
+        belongs to this manifest nor already exists on disk.
+        """
+        if num is None:
+            num = self.next_num
+            while part_filename(num) in self.parts or os.path.exists(
+                os.path.join(self.dirname, part_filename(num))
+            ):
+                num += 1
+        self.next_num = max(self.next_num, num + 1)
+
+        part = Part(num, url)
+        self.remove(part.filename)
+        self.parts[part.filename] = part
+        return part
+
+    def keep_text(self, part, text):
+        """Keep the parsed text of a part in memory instead of on disk."""
+        part.text = text
+        part.size = sum(len(line) for line in text)
+        self.text_size += part.size
+
+    def filenames(self, start=0, end=None):
+        """Get the filenames of parts start to end, in the order written."""
+        return list(islice(self.parts, start, end))
+
+    def remove(self, filename):
+        """Forget a part, returning it, or None if it is not recorded."""
+        part = self.parts.pop(filename, None)
+        if part is not None and part.in_memory:
+            self.text_size -= part.size
+        return part
+
+    def to_dict(self, start_num=0):
+        """Return the state of the manifest, without in-memory text.
+
+        Only parts numbered start_num or higher are included. Parts are
+        numbered in the order written, so these are found from the end
+        without visiting the parts written before them.
+        """
+        parts = []
+        for part in reversed(self.parts.values()):
+            if part.num < start_num:
+                break
+            parts.append(part.to_dict())
+        parts.reverse()
+        return {"dirname": self.dirname, "next_num": self.next_num, "parts": parts}
+
+    def restore(self, state):
+        """Record the parts of a state from to_dict that are not recorded yet."""
+        for entry in state["parts"]:
+            if part_filename(entry["num"]) not in self.parts:
+                part = self.new_part(entry["url"], entry["num"])
+                part.size = entry["size"]
+        self.next_num = max(self.next_num, state["next_num"])
@@ -1,13 +1,23 @@
+from collections import deque
 from collections.abc import MutableSet
 
 
 class OrderedSet(MutableSet):
+    """A set that remembers insertion order, stored as a set plus a deque.
+
+    Discarded keys are left in the deque and skipped later (lazy deletion),
+    so add, discard and pop from either end are all O(1) amortized. Every
+    stale deque entry of a key comes before its live entry, so counting a
+    key's stale entries is enough to tell them apart.
+    """
+
     def __init__(self, iterable=None):
-        self.end = end = []
-        end += [None, end, end]  # sentinel node for doubly linked list
-        self.map = {}  # key --> [key, prev, next]
+        self.map = set()  # Live keys
+        self.order = deque()  # Keys in insertion order, including stale ones
+        self.stale = {}  # key --> number of its stale entries in order
+        self.num_stale = 0
         if iterable is not None:
-            self |= iterable
+            self.update(iterable)
 
     def __len__(self):
         return len(self.map)
@@ -17,44 +27,87 @@ class OrderedSet(MutableSet):
 
     def add(self, key):
         if key not in self.map:
-            end = self.end
-            curr = end[1]
-            curr[2] = end[1] = self.map[key] = [key, curr, end]
+            self.map.add(key)
+            self.order.append(key)
 
     def update(self, iterable):
-        for item in iterable:
-            self.add(item)
+        new_keys = [x for x in dict.fromkeys(iterable) if x not in self.map]
+        self.map.update(new_keys)
+        self.order.extend(new_keys)
 
     def discard(self, key):
         if key in self.map:
-            key, prev, next = self.map.pop(key)
-            prev[2] = next
-            next[1] = prev
+            self.map.remove(key)
+            self.stale[key] = self.stale.get(key, 0) + 1
+            self.num_stale += 1
+            if self.num_stale > max(len(self.map), 64):
+                self.compact()
+
+    def compact(self):
+        """Rebuild the deque without stale entries."""
+        self.order = deque(self)
+        self.stale = {}
+        self.num_stale = 0
+
+    def skip_stale(self, key):
+        """Forget one stale entry of key, returning False if key has none."""
+        count = self.stale.get(key)
+        if not count:
+            return False
+        if count == 1:
+            del self.stale[key]
+        else:
+            self.stale[key] = count - 1
+        self.num_stale -= 1
+        return True
 
     def __iter__(self):
-        end = self.end
-        curr = end[2]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[2]
+        skipped = {}  # key --> stale entries of key passed so far
+        for key in self.order:
+            if key in self.stale:
+                num_skipped = skipped.get(key, 0)
+                if num_skipped < self.stale[key]:
+                    skipped[key] = num_skipped + 1
+                    continue
+            if key in self.map:
+                yield key
 
     def __reversed__(self):
-        end = self.end
-        curr = end[1]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[1]
+        yielded = set()  # Yielded keys that have stale entries
+        for key in reversed(self.order):
+            # The last entry of a live key is its live one
+            if key in self.map and key not in yielded:
+                if key in self.stale:
+                    yielded.add(key)
+                yield key
 
     def pop(self, last=True):
-        if not self:
+        if not self.map:
             raise KeyError("set is empty")
-        key = self.end[1][0] if last else self.end[2][0]
-        self.discard(key)
-        return key
+        if not self.stale:
+            key = self.order.pop() if last else self.order.popleft()
+            self.map.remove(key)
+            return key
+        while True:
+            if last:
+                key = self.order.pop()
+                # The last entry of a live key is its live one
+                is_live = key in self.map
+                if not is_live:
+                    self.skip_stale(key)
+            else:
+                key = self.order.popleft()
+                # Stale entries of a key come before its live one
+                is_live = not self.skip_stale(key)
+            if is_live:
+                self.map.remove(key)
+                return key
 
     def clear(self):
-        while self:
-            self.pop()
+        self.map = set()
+        self.order = deque()
+        self.stale = {}
+        self.num_stale = 0
 
     def __repr__(self):
         if not self:
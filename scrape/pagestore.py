@@ -0,0 +1,227 @@
+"""A compressed, content-addressed store of pages, in place of PART.html files.
+
+Pages are compressed by zlib and appended to segment files of up to
+SEGMENT_SIZE bytes each, so a crawl writes a few large files rather than
+one file per page. Each page is addressed by the SHA-1 hash of its
+content, which is computed before the page is written, so identical
+pages are only stored once. An index, appended to as pages are stored,
+maps each part number to the URL and hash of its page and each hash to
+where its page is, so any page can be read back without reading the
+pages stored before it, and pages can be looked up by URL or by hash.
+The index is read back when a store is reopened.
+"""
+
+import codecs
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+
+from .streaming import CHUNK_SIZE, SPOOL_SIZE, is_stream, iter_chunks
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+COMPRESS_LEVEL = 6
+INDEX_FILENAME = "index.jsonl"
+
+
+class PageStore(object):
+    """Pages stored by part number in compressed segment files."""
+
+    def __init__(self, dirname, segment_size=SEGMENT_SIZE):
+        """Open or create a page store in a directory.
+
+        Keyword arguments:
+        dirname -- directory of the store's segments and index (str)
+        segment_size -- bytes written to a segment before starting another (int)
+        """
+        self.dirname = dirname
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.pages = {}  # part number --> (URL, fingerprint) of its page
+        self.urls = {}  # URL --> part number of its latest page
+        self.nums = {}  # fingerprint --> part numbers of the pages with it
+        self.locations = {}  # fingerprint --> (segment, offset, length)
+        self.segment_num = 0
+        self.segment = None  # Segment file being appended to
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        index_path = os.path.join(dirname, INDEX_FILENAME)
+        if os.path.exists(index_path):
+            self.read_index(index_path)
+        self.index = open(index_path, "a")
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, num):
+        return num in self.pages
+
+    def read_index(self, index_path):
+        """Rebuild the store's state from its index."""
+        with open(index_path, "r") as infile:
+            for line in infile:
+                entry = json.loads(line)
+                if entry.get("removed"):
+                    self.forget(entry["num"])
+                    continue
+                location = (entry["segment"], entry["offset"], entry["length"])
+                self.locations[entry["fingerprint"]] = location
+                self.remember(entry["num"], entry["url"], entry["fingerprint"])
+                self.segment_num = max(self.segment_num, entry["segment"])
+
+    def remember(self, num, url, fingerprint):
+        if self.pages.get(num, (None, fingerprint))[1] != fingerprint:
+            self.forget(num)
+        self.pages[num] = (url, fingerprint)
+        self.urls[url] = num
+        self.nums.setdefault(fingerprint, set()).add(num)
+
+    def forget(self, num):
+        """Forget the page of a part, and its location if no part has it."""
+        url, fingerprint = self.pages.pop(num, (None, None))
+        if url is not None and self.urls.get(url) == num:
+            del self.urls[url]
+        if fingerprint is not None:
+            nums = self.nums[fingerprint]
+            nums.discard(num)
+            if not nums:
+                del self.nums[fingerprint]
+                del self.locations[fingerprint]
+
+    def get_segment_filename(self, segment_num):
+        return os.path.join(self.dirname, "segment{0}.z".format(segment_num))
+
+    def get_segment(self):
+        """Get the segment file to append to, starting a new one when full."""
+        if self.segment is None:
+            self.segment = open(self.get_segment_filename(self.segment_num), "ab")
+        if self.segment.tell() >= self.segment_size:
+            self.segment.close()
+            self.segment_num += 1
+            self.segment = open(self.get_segment_filename(self.segment_num), "ab")
+        return self.segment
+
+    def put(self, num, url, page):
+        """Store the page of a part.
+
+        Keyword arguments:
+        num -- the part number (int)
+        url -- the URL of the page (str)
+        page -- the page (str), or a file object or iterable of chunks of it
+
+        The page is hashed before it is written, and not written at all if
+        an identical page is already stored. Return the number of compressed
+        bytes written.
+        """
+        spooled = None
+        if not isinstance(page, str) and not is_stream(page):
+            # The page is read twice, to hash it and then to write it
+            page = spooled = self.spool(page)
+        try:
+            content_hash = hashlib.sha1()
+            for chunk in self.iter_page(page):
+                content_hash.update(chunk.encode("utf-8"))
+            fingerprint = content_hash.hexdigest()
+
+            with self.lock:
+                length = 0
+                location = self.locations.get(fingerprint)
+                if location is None:
+                    segment = self.get_segment()
+                    offset = segment.tell()
+                    compressor = zlib.compressobj(COMPRESS_LEVEL)
+                    for chunk in self.iter_page(page):
+                        segment.write(compressor.compress(chunk.encode("utf-8")))
+                    segment.write(compressor.flush())
+                    segment.flush()
+                    length = segment.tell() - offset
+                    location = (self.segment_num, offset, length)
+                    self.locations[fingerprint] = location
+
+                self.remember(num, url, fingerprint)
+                entry = {"num": num, "url": url, "fingerprint": fingerprint}
+                entry.update(zip(("segment", "offset", "length"), location))
+                self.index.write(json.dumps(entry) + "\n")
+                self.index.flush()
+        finally:
+            if spooled is not None:
+                spooled.close()
+        return length
+
+    @staticmethod
+    def iter_page(page):
+        if is_stream(page):
+            return iter_chunks(page)
+        return [page]
+
+    @staticmethod
+    def spool(chunks):
+        """Write chunks of text to a temporary file, which is returned."""
+        outfile = tempfile.SpooledTemporaryFile(
+            SPOOL_SIZE, mode="w+", encoding="utf-8", newline=""
+        )
+        for chunk in chunks:
+            outfile.write(chunk)
+        return outfile
+
+    def iter_chunks(self, num):
+        """Read the page of a part, one chunk of text at a time."""
+        segment_num, offset, length = self.locations[self.pages[num][1]]
+        decompressor = zlib.decompressobj()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        with open(self.get_segment_filename(segment_num), "rb") as segment:
+            segment.seek(offset)
+            while length > 0:
+                data = segment.read(min(CHUNK_SIZE, length))
+                if not data:
+                    break
+                length -= len(data)
+                chunk = decoder.decode(decompressor.decompress(data))
+                if chunk:
+                    yield chunk
+        chunk = decoder.decode(decompressor.flush(), final=True)
+        if chunk:
+            yield chunk
+
+    def get(self, num):
+        """Get the page of a part as a string."""
+        return "".join(self.iter_chunks(num))
+
+    def open(self, num):
+        """Get the page of a part as a temporary file, to parse in chunks."""
+        infile = self.spool(self.iter_chunks(num))
+        infile.seek(0)
+        return infile
+
+    def find_url(self, url):
+        """Get the part number of the latest page of a URL, or None."""
+        return self.urls.get(url)
+
+    def find_fingerprint(self, fingerprint):
+        """Get the part numbers of the pages with a fingerprint, in order."""
+        return sorted(self.nums.get(fingerprint, ()))
+
+    def remove(self, num):
+        """Forget the page of a part.
+
+        Its data stays in its segment until the store is destroyed.
+        """
+        with self.lock:
+            if num in self.pages:
+                self.forget(num)
+                self.index.write(json.dumps({"num": num, "removed": True}) + "\n")
+                self.index.flush()
+
+    def close(self):
+        self.index.close()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def destroy(self):
+        """Close the store and delete its directory."""
+        self.close()
+        shutil.rmtree(self.dirname)
@@ -0,0 +1,35 @@
+"""A reusable filter that keeps lines matching regular expressions."""
+
+import re
+
+
+class RegexFilter(object):
+    """Keeps the lines of text matched by any of a list of regexps.
+
+    Patterns are compiled once, so a single RegexFilter can be applied to
+    every page of a crawl. Lines are kept in their original order, each
+    line at most once, and a match must be non-empty to count.
+    """
+
+    def __init__(self, regexps):
+        self.regexps = [re.compile(x) for x in regexps]
+
+    def match(self, line):
+        """Return whether any regexp finds a non-empty match in line."""
+        for regexp in self.regexps:
+            found = regexp.search(line)
+            if found and found.group():
+                return True
+        return False
+
+    def __call__(self, text):
+        """Filter text (list), returning all of it if no line matches."""
+        matched_text = []
+        seen = set()
+        for line in text:
+            if line in seen:
+                continue
+            if self.match(line):
+                seen.add(line)
+                matched_text.append(line)
+        return matched_text or text
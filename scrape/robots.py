@@ -0,0 +1,125 @@
+"""robots.txt rules, fetched once per host and cached in memory and on disk.
+
+Each host's robots.txt is saved to a directory under utils.CACHE_DIR, so
+later runs only fetch it again once it is older than the cache's TTL.
+"""
+
+import io
+import os
+import threading
+import time
+
+from six.moves.urllib.parse import urlparse
+
+from . import utils
+
+DEFAULT_TTL = 24 * 60 * 60  # Seconds a saved robots.txt is trusted for
+TIMEOUT = 10  # Seconds to wait for a robots.txt before allowing everything
+USER_AGENT = "scrape"
+DISALLOW_ALL = "User-agent: *\nDisallow: /\n"
+DISALLOWED = object()  # Fetched in place of a page robots.txt disallows
+
+
+def get_cache_dir():
+    """Get the directory robots.txt files are saved in."""
+    return os.path.join(utils.CACHE_DIR, "robots")
+
+
+def fetch_robots_txt(robots_url):
+    """Fetch a robots.txt file, returning its text or None if it is unknown.
+
+    As with urllib.robotparser, a 401 or 403 response disallows everything
+    and any other 4xx response allows everything. Server and connection
+    errors return None, so the file is not saved and is fetched again next
+    run. The file is requested as USER_AGENT, whose rules are the ones
+    checked.
+    """
+    headers = {"User-Agent": USER_AGENT}
+    try:
+        resp = utils.get_session().get(robots_url, headers=headers, timeout=TIMEOUT)
+    except Exception:
+        return None
+    if resp.status_code in (401, 403):
+        return DISALLOW_ALL
+    if 400 <= resp.status_code < 500:
+        return ""
+    if resp.status_code >= 500:
+        return None
+    return resp.text
+
+
+class RobotsCache(object):
+    """Answers whether URLs may be crawled according to robots.txt."""
+
+    def __init__(self, scheduler=None, cache_dir=None, ttl=DEFAULT_TTL):
+        """Set where robots.txt files are saved and how long they are kept.
+
+        Keyword arguments:
+        scheduler -- limits robots.txt requests like other requests, and is
+                     spaced out by the Crawl-delay of each host (HostScheduler)
+        cache_dir -- directory to save robots.txt files in, or None for
+                     get_cache_dir() (str)
+        ttl -- seconds before a saved robots.txt is fetched again (int)
+        """
+        self.scheduler = scheduler
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.parsers = {}  # scheme://host --> RobotFileParser of its robots.txt
+        self.host_locks = {}  # scheme://host --> Lock held while reading it
+
+    def get_filename(self, root):
+        """Get the filename of the saved robots.txt of scheme://host root."""
+        return os.path.join(self.cache_dir, "{0}.txt".format(utils.hash_text(root)))
+
+    def read_robots_txt(self, root):
+        """Read the robots.txt of root from disk, or fetch and save it."""
+        filename = self.get_filename(root)
+        if os.path.exists(filename):
+            if time.time() - os.path.getmtime(filename) < self.ttl:
+                with io.open(filename, "r", encoding="utf-8") as infile:
+                    return infile.read()
+
+        robots_url = "{0}/robots.txt".format(root)
+        if self.scheduler is None:
+            text = fetch_robots_txt(robots_url)
+        else:
+            with self.scheduler.slot(urlparse(root).netloc):
+                text = fetch_robots_txt(robots_url)
+        if text is not None:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with io.open(filename, "w", encoding="utf-8") as outfile:
+                outfile.write(text)
+        return text
+
+    def get_parser(self, url):
+        """Get the parsed robots.txt of the host of url, reading it once.
+
+        The first call for a host may fetch its robots.txt, so call it from
+        a thread that is allowed to block, as for any other request.
+        """
+        parsed_url = urlparse(url)
+        root = "{0}://{1}".format(parsed_url.scheme, parsed_url.netloc)
+        parser = self.parsers.get(root)
+        if parser is not None:
+            return parser
+
+        from six.moves.urllib.robotparser import RobotFileParser
+
+        with self.lock:
+            host_lock = self.host_locks.setdefault(root, threading.Lock())
+        with host_lock:
+            parser = self.parsers.get(root)
+            if parser is None:
+                parser = RobotFileParser()
+                parser.parse((self.read_robots_txt(root) or "").splitlines())
+                delay = parser.crawl_delay(USER_AGENT)
+                if delay and self.scheduler is not None:
+                    self.scheduler.set_delay(parsed_url.netloc, delay)
+                self.parsers[root] = parser
+        return parser
+
+    def can_fetch(self, url):
+        """Return whether robots.txt allows url to be crawled."""
+        return self.get_parser(url).can_fetch(USER_AGENT, url)
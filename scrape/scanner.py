@@ -0,0 +1,106 @@
+"""Single-pass extraction of links and text from HTML, without a DOM.
+
+A PageScanner is an lxml parser target: the parser calls it for every
+tag and piece of text as the page is parsed, and no element tree is
+built. This is enough for the crawler, which only needs the links on a
+page and its text to decide whether the page is new.
+"""
+
+from __future__ import absolute_import
+
+from .streaming import is_stream, iter_chunks
+
+LINK_TAGS = ("a",)
+SKIPPED_TEXT_TAGS = frozenset(("script", "style"))
+
+
+class PageScanner(object):
+    """Collects the links and text of a page as it is parsed.
+
+    Links are the hrefs of the given link tags, in document order, as
+    they appear in the page.
+
+    Text is gathered like the XPath used by utils.parse_text: the text
+    directly inside every element except script and style, in document
+    order, with no whitespace cleanup. Values of the given attributes are
+    gathered from the same elements.
+    """
+
+    def __init__(self, link_tags=LINK_TAGS, attributes=()):
+        """Set which tags to take hrefs from and which attributes to gather.
+
+        Keyword arguments:
+        link_tags -- tags whose href attributes are links (tuple)
+        attributes -- names of attributes whose values to gather (tuple)
+        """
+        self.link_tags = frozenset(link_tags)
+        self.links = []
+        self.text = []
+        self.attributes = dict((name, []) for name in attributes)
+        self.open_tags = []
+        self.chunks = []  # Pieces of the current text node
+
+    def flush_text(self):
+        """End the current text node, keeping it unless in script or style.
+
+        Text after the root element has closed is not part of the tree, so
+        it is dropped too.
+        """
+        if self.chunks:
+            if self.open_tags and self.open_tags[-1] not in SKIPPED_TEXT_TAGS:
+                self.text.append("".join(self.chunks))
+            self.chunks = []
+
+    def start(self, tag, attrib):
+        self.flush_text()
+        self.open_tags.append(tag)
+        if self.attributes and tag not in SKIPPED_TEXT_TAGS:
+            for name, values in self.attributes.items():
+                if name in attrib:
+                    values.append(attrib[name])
+        if tag in self.link_tags:
+            href = attrib.get("href")
+            if href is not None:
+                self.links.append(href)
+
+    def end(self, tag):
+        self.flush_text()
+        if self.open_tags:
+            self.open_tags.pop()
+
+    def data(self, data):
+        self.chunks.append(data)
+
+    def comment(self, text):
+        self.flush_text()
+
+    def pi(self, target, data=None):
+        self.flush_text()
+
+    def close(self):
+        self.flush_text()
+        return self
+
+
+def scan_html(raw_html, **kwargs):
+    """Parse HTML with a PageScanner and return the scanner.
+
+    Keyword arguments:
+    raw_html -- unparsed HTML content (str, bytes or file object)
+    kwargs -- passed on to PageScanner
+
+    A file object is read and parsed one chunk at a time.
+    """
+    import lxml.etree
+
+    scanner = PageScanner(**kwargs)
+    chunks = iter_chunks(raw_html) if is_stream(raw_html) else [raw_html]
+    parser = None
+    for chunk in chunks:
+        if chunk:
+            if parser is None:
+                parser = lxml.etree.HTMLParser(target=scanner)
+            parser.feed(chunk)
+    if parser is None:
+        return scanner.close()
+    return parser.close()
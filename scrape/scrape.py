@@ -5,7 +5,7 @@
 """
 
 from __future__ import absolute_import, print_function
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 import os
 import sys
 
@@ -13,8 +13,37 @@ from six.moves import input
 from six import iterkeys
 
 from .crawler import Crawler
+from .simhash import FINGERPRINT_BITS
 from . import utils, __version__
 
+MAX_NEAR_DUP_THRESHOLD = FINGERPRINT_BITS // 2 - 1
+
+
+def near_dup_threshold(value):
+    """Convert an argument to a SimHash threshold that SimHashIndex supports."""
+    threshold = int(value)
+    if not 0 <= threshold <= MAX_NEAR_DUP_THRESHOLD:
+        raise ArgumentTypeError(
+            "must be between 0 and {0}".format(MAX_NEAR_DUP_THRESHOLD)
+        )
+    return threshold
+
+
+def positive_int(value):
+    """Convert an argument to an int greater than 0."""
+    number = int(value)
+    if number <= 0:
+        raise ArgumentTypeError("must be greater than 0")
+    return number
+
+
+def positive_float(value):
+    """Convert an argument to a float greater than 0."""
+    number = float(value)
+    if not number > 0:
+        raise ArgumentTypeError("must be greater than 0")
+    return number
+
 
 def get_parser():
     """Parse command-line arguments."""
@@ -40,9 +69,44 @@ def get_parser():
         help="regexp rules for following new pages",
     )
     parser.add_argument(
-        "-C", "--clear-cache", help="clear requests cache", action="store_true"
+        "-C", "--clear-cache", help="clear response cache", action="store_true"
+    )
+    parser.add_argument(
+        "--cache-backend",
+        choices=["sqlite", "filesystem"],
+        help="where to cache responses (default: sqlite)",
+        default="sqlite",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        help="max MB of compressed responses cached (default: 256)",
+        default=256,
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="print response and domain cache hit rates and bytes saved",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        help="seconds before a cached response expires (default: 86400)",
+        default=86400,
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="max number of concurrent fetches when crawling (default: 1)",
+        default=1,
     )
     parser.add_argument("--csv", help="write files as csv", action="store_true")
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        help="save crawl state every N pages so it can be resumed (default: off)",
+        default=0,
+    )
     parser.add_argument(
         "-cs",
         "--cache-size",
@@ -54,20 +118,55 @@ def get_parser():
     parser.add_argument(
         "-f", "--filter", type=str, nargs="*", help="regexp rules for filtering text"
     )
+    parser.add_argument(
+        "--frontier",
+        choices=["memory", "sqlite"],
+        help="where to queue links while crawling (default: memory)",
+        default="memory",
+    )
+    parser.add_argument(
+        "-hc",
+        "--host-concurrency",
+        type=positive_int,
+        help="max number of concurrent fetches to a host when crawling",
+    )
     parser.add_argument("--html", help="write files as HTML", action="store_true")
     parser.add_argument("-i", "--images", action="store_true", help="save page images")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="when recrawling, skip pages unchanged since they were last crawled",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep-unicode",
+        action="store_true",
+        help="keep non-ASCII characters in text output",
+    )
     parser.add_argument(
         "-m", "--multiple", help="save to multiple files", action="store_true"
     )
     parser.add_argument(
         "-max", "--max-crawls", type=int, help="max number of pages to crawl"
     )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        help="max MB of page text kept in memory before using disk (default: 256)",
+        default=256,
+    )
     parser.add_argument(
         "-n",
         "--nonstrict",
         action="store_true",
         help="allow crawler to visit any domain",
     )
+    parser.add_argument(
+        "-nd",
+        "--near-dup-threshold",
+        type=near_dup_threshold,
+        help="skip pages within this many bits (0-31) of a crawled page's SimHash",
+    )
     parser.add_argument(
         "-ni", "--no-images", action="store_true", help="do not save page images"
     )
@@ -83,18 +182,59 @@ def get_parser():
     parser.add_argument(
         "-ow", "--overwrite", action="store_true", help="overwrite a file if it exists"
     )
+    parser.add_argument(
+        "--page-store",
+        action="store_true",
+        help="store pages in compressed segment files instead of PART.html files",
+    )
     parser.add_argument("-p", "--pdf", help="write files as pdf", action="store_true")
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        help="max number of connections kept open per host (default: 10)",
+        default=10,
+    )
     parser.add_argument("-pt", "--print", help="print text output", action="store_true")
     parser.add_argument(
         "-q", "--quiet", help="suppress program output", action="store_true"
     )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help="resume a crawl saved by --checkpoint-interval or an interrupt",
+    )
+    parser.add_argument(
+        "-ra",
+        "--rate",
+        type=positive_float,
+        help="max number of requests per second to a host when crawling",
+    )
+    parser.add_argument(
+        "-ro",
+        "--robots",
+        action="store_true",
+        help="skip pages disallowed by robots.txt and obey its Crawl-delay",
+    )
     parser.add_argument(
         "-s", "--single", help="save to a single file", action="store_true"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="parse pages in chunks to bound memory, without saving images",
+    )
     parser.add_argument("-t", "--text", help="write files as text", action="store_true")
     parser.add_argument(
         "-v", "--version", help="display current version", action="store_true"
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="max number of URLs to fetch at once (default: 1)",
+        default=1,
+    )
     parser.add_argument(
         "-x", "--xpath", type=str, nargs="?", help="filter HTML using XPath"
     )
@@ -126,6 +266,24 @@ def write_files(args, infilenames, outfilename):
             utils.remove_part_files()
 
 
+def prefetch_urls(args):
+    """Fetch every URL query that is not being crawled, in parallel.
+
+    Return a dict mapping each URL query to its raw response.
+    """
+    if args["crawl"] or args["crawl_all"]:
+        return {}
+    urls = [x for x in args["query"] if x not in args["files"]]
+    return utils.get_raw_resps(urls, args["workers"], args["stream"])
+
+
+def close_streams(raw_resps):
+    """Close the streamed responses of prefetch_urls, deleting their files."""
+    for raw_resp in raw_resps.values():
+        if utils.is_stream(raw_resp):
+            raw_resp.close()
+
+
 def write_single_file(args, base_dir, crawler):
     """Write to a single output file and/or subdirectory."""
     if args["urls"] and args["html"]:
@@ -135,23 +293,29 @@ def write_single_file(args, base_dir, crawler):
             print("Storing html files in {0}/".format(domain))
         utils.mkdir_and_cd(domain)
 
+    raw_resps = prefetch_urls(args)
     infilenames = []
-    for query in args["query"]:
-        if query in args["files"]:
-            infilenames.append(query)
-        elif query.strip("/") in args["urls"]:
-            if args["crawl"] or args["crawl_all"]:
-                # Crawl and save HTML files/image files to disk
-                infilenames += crawler.crawl_links(query)
-            else:
-                raw_resp = utils.get_raw_resp(query)
-                if raw_resp is None:
-                    return False
-
-                prev_part_num = utils.get_num_part_files()
-                utils.write_part_file(args, query, raw_resp)
-                curr_part_num = prev_part_num + 1
-                infilenames += utils.get_part_filenames(curr_part_num, prev_part_num)
+    try:
+        for query in args["query"]:
+            if query in args["files"]:
+                infilenames.append(query)
+            elif query.strip("/") in args["urls"]:
+                if args["crawl"] or args["crawl_all"]:
+                    # Crawl and save HTML files/image files to disk
+                    infilenames += crawler.crawl_links(query)
+                else:
+                    raw_resp = raw_resps[query]
+                    if raw_resp is None:
+                        return False
+
+                    prev_part_num = utils.get_num_part_files()
+                    utils.write_part_file(args, query, raw_resp)
+                    curr_part_num = prev_part_num + 1
+                    infilenames += utils.get_part_filenames(
+                        curr_part_num, prev_part_num
+                    )
+    finally:
+        close_streams(raw_resps)
 
     # Convert output or leave as PART.html files
     if args["html"]:
@@ -173,53 +337,57 @@ def write_single_file(args, base_dir, crawler):
 
 def write_multiple_files(args, base_dir, crawler):
     """Write to multiple output files and/or subdirectories."""
-    for i, query in enumerate(args["query"]):
-        if query in args["files"]:
-            # Write files
-            if args["out"] and i < len(args["out"]):
-                outfilename = args["out"][i]
-            else:
-                outfilename = ".".join(query.split(".")[:-1])
-            write_files(args, [query], outfilename)
-        elif query in args["urls"]:
-            # Scrape/crawl urls
-            domain = utils.get_domain(query)
-            if args["html"]:
-                # Create a directory to save PART.html files in
-                if not args["quiet"]:
-                    print("Storing html files in {0}/".format(domain))
-                utils.mkdir_and_cd(domain)
-
-            if args["crawl"] or args["crawl_all"]:
-                # Crawl and save HTML files/image files to disk
-                infilenames = crawler.crawl_links(query)
-            else:
-                raw_resp = utils.get_raw_resp(query)
-                if raw_resp is None:
-                    return False
-
-                # Saves page as PART.html file
-                prev_part_num = utils.get_num_part_files()
-                utils.write_part_file(args, query, raw_resp)
-                curr_part_num = prev_part_num + 1
-                infilenames = utils.get_part_filenames(curr_part_num, prev_part_num)
-
-            # Convert output or leave as PART.html files
-            if args["html"]:
-                # HTML files have been written already, so return to base dir
-                os.chdir(base_dir)
-            else:
-                # Write files to text or pdf
-                if infilenames:
-                    if args["out"] and i < len(args["out"]):
-                        outfilename = args["out"][i]
-                    else:
-                        outfilename = utils.get_outfilename(query, domain)
-                    write_files(args, infilenames, outfilename)
+    raw_resps = prefetch_urls(args)
+    try:
+        for i, query in enumerate(args["query"]):
+            if query in args["files"]:
+                # Write files
+                if args["out"] and i < len(args["out"]):
+                    outfilename = args["out"][i]
                 else:
-                    sys.stderr.write(
-                        "Failed to retrieve content from {0}.\n".format(query)
-                    )
+                    outfilename = ".".join(query.split(".")[:-1])
+                write_files(args, [query], outfilename)
+            elif query in args["urls"]:
+                # Scrape/crawl urls
+                domain = utils.get_domain(query)
+                if args["html"]:
+                    # Create a directory to save PART.html files in
+                    if not args["quiet"]:
+                        print("Storing html files in {0}/".format(domain))
+                    utils.mkdir_and_cd(domain)
+
+                if args["crawl"] or args["crawl_all"]:
+                    # Crawl and save HTML files/image files to disk
+                    infilenames = crawler.crawl_links(query)
+                else:
+                    raw_resp = raw_resps[query]
+                    if raw_resp is None:
+                        return False
+
+                    # Saves page as PART.html file
+                    prev_part_num = utils.get_num_part_files()
+                    utils.write_part_file(args, query, raw_resp)
+                    curr_part_num = prev_part_num + 1
+                    infilenames = utils.get_part_filenames(curr_part_num, prev_part_num)
+
+                # Convert output or leave as PART.html files
+                if args["html"]:
+                    # HTML files have been written already, so return to base dir
+                    os.chdir(base_dir)
+                else:
+                    # Write files to text or pdf
+                    if infilenames:
+                        if args["out"] and i < len(args["out"]):
+                            outfilename = args["out"][i]
+                        else:
+                            outfilename = utils.get_outfilename(query, domain)
+                        write_files(args, infilenames, outfilename)
+                    else:
+                        sys.stderr.write(
+                            "Failed to retrieve content from {0}.\n".format(query)
+                        )
+    finally:
+        close_streams(raw_resps)
     return True
 
 
@@ -246,6 +414,7 @@ def detect_output_type(args):
 
 def scrape(args):
     """Scrape webpage content."""
+    crawler = None
     try:
         base_dir = os.getcwd()
         if args["out"] is None:
@@ -271,8 +440,14 @@ def scrape(args):
             sys.stderr.write("Cannot convert local files to HTML.\n")
             args["files"] = []
 
+        if args["urls"]:
+            # Share pooled connections between all fetches, with enough
+            # connections per host for every concurrent fetch
+            utils.init_session(
+                max(args["pool_size"], args["concurrency"], args["workers"])
+            )
+
         # Instantiate web crawler if necessary
-        crawler = None
         if args["crawl"] or args["crawl_all"]:
             crawler = Crawler(args)
 
@@ -287,7 +462,8 @@ def scrape(args):
                 os.chdir(base_dir)
             except OSError:
                 pass
-        else:
+        elif crawler is None or not crawler.checkpointing:
+            # A saved crawl keeps its PART.html files until it is resumed
             utils.remove_part_files()
         raise
 
@@ -343,9 +519,17 @@ def command_line_runner():
         parser.print_help()
         return
 
+    # Streamed pages are saved as they download, so their images are not
+    if args["stream"]:
+        if args["images"]:
+            parser.error("argument --stream: not allowed with argument -i/--images")
+        args["no_images"] = True
+
     # Enable cache unless user sets environ variable SCRAPE_DISABLE_CACHE
     if not os.getenv("SCRAPE_DISABLE_CACHE"):
-        utils.enable_cache()
+        utils.enable_cache(
+            args["cache_backend"], args["cache_ttl"], args["cache_max_mb"] * 1048576
+        )
 
     # Save images unless user sets environ variable SCRAPE_DISABLE_IMGS
     if os.getenv("SCRAPE_DISABLE_IMGS"):
@@ -358,7 +542,15 @@ def command_line_runner():
     prompt_save_images(args)
 
     # Scrape webpage content
-    scrape(args)
+    try:
+        scrape(args)
+    except KeyboardInterrupt:
+        # Anything worth keeping, such as a saved crawl, is already saved
+        sys.exit(130)
+    finally:
+        if args["cache_stats"]:
+            utils.print_cache_stats()
+        utils.close_cache()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+"""A pooled, keep-alive HTTP session shared by every fetch."""
+
+from __future__ import absolute_import
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+
+class ConnectionStats(object):
+    """Counts requests sent and connections opened by a session."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+
+    @property
+    def reused(self):
+        """Number of requests served over an already open connection."""
+        return max(self.requests - self.opened, 0)
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self.lock:
+            self.opened += 1
+
+    def __repr__(self):
+        return "{0}(requests={1}, opened={2}, reused={3})".format(
+            self.__class__.__name__, self.requests, self.opened, self.reused
+        )
+
+
+def counting_pool(pool_cls, stats):
+    """Subclass a urllib3 connection pool to count new connections."""
+
+    class CountingPool(pool_cls):
+        def _new_conn(self):
+            stats.record_connection()
+            return super(CountingPool, self)._new_conn()
+
+    CountingPool.__name__ = "Counting{0}".format(pool_cls.__name__)
+    return CountingPool
+
+
+def is_cacheable(request):
+    """Return whether a request's response may come from a response cache.
+
+    Only GET requests are cached, and conditional requests always go to
+    the server, which decides whether the page changed.
+    """
+    return request.method == "GET" and not any(
+        x in request.headers for x in ("If-None-Match", "If-Modified-Since")
+    )
+
+
+def build_cached_response(request, status, headers, body):
+    """Build a response to a request from a response cache entry."""
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers = CaseInsensitiveDict(headers)
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.url = request.url
+    resp.request = request
+    resp._content = body
+    resp._content_consumed = True
+    return resp
+
+
+class PooledAdapter(HTTPAdapter):
+    """An HTTPAdapter that keeps a pool of connections per host.
+
+    Given a cache.ResponseCache, successful GET responses are served from
+    it and stored in it. Streamed responses are served from the cache but
+    not stored, since storing them would read them whole into memory.
+    """
+
+    def __init__(self, stats, pool_size=DEFAULT_POOL_SIZE, cache=None):
+        self.stats = stats
+        self.cache = cache
+        super(PooledAdapter, self).__init__(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: counting_pool(pool_cls, self.stats)
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def send(self, request, **kwargs):
+        cacheable = self.cache is not None and is_cacheable(request)
+        if cacheable:
+            entry = self.cache.get(request.url)
+            if entry is not None:
+                return build_cached_response(request, *entry)
+
+        self.stats.record_request()
+        resp = super(PooledAdapter, self).send(request, **kwargs)
+        if cacheable and resp.status_code == 200 and not kwargs.get("stream"):
+            self.cache.set(request.url, resp.status_code, resp.headers, resp.content)
+        return resp
+
+
+def new_session(pool_size=DEFAULT_POOL_SIZE, proxies=None, cache=None):
+    """Create a session with pooled, keep-alive connections.
+
+    Keyword arguments:
+    pool_size -- max number of connections kept open per host (int)
+    proxies -- proxies to use for every request (dict) (default: None)
+    cache -- cache of responses (cache.ResponseCache) (default: None)
+
+    The session's ConnectionStats are available as its stats attribute.
+    """
+    session = requests.Session()
+    session.stats = ConnectionStats()
+    adapter = PooledAdapter(session.stats, pool_size, cache)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if proxies:
+        session.proxies.update(proxies)
+    return session
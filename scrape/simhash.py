@@ -0,0 +1,103 @@
+"""SimHash fingerprints for detecting near-duplicate pages.
+
+Pages whose text differs only slightly (a timestamp, a session token)
+get fingerprints that differ in only a few bits, so near-duplicates can
+be found by looking for fingerprints within a small Hamming distance.
+"""
+
+from collections import Counter, deque
+import hashlib
+import re
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+
+
+def get_features(text):
+    """Split text into overlapping lowercase word shingles."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return words
+    return [
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    ]
+
+
+def simhash(text):
+    """Return the 64-bit SimHash fingerprint of a string."""
+    weights = [0] * FINGERPRINT_BITS
+    for feature, count in Counter(get_features(text)).items():
+        digest = hashlib.md5(feature.encode("utf-8")).digest()
+        feature_hash = int.from_bytes(digest[:8], "big")
+        for bit in range(FINGERPRINT_BITS):
+            if feature_hash >> bit & 1:
+                weights[bit] += count
+            else:
+                weights[bit] -= count
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(x, y):
+    """Return the number of bits that differ between two fingerprints."""
+    return bin(x ^ y).count("1")
+
+
+class SimHashIndex(object):
+    """Finds fingerprints within a Hamming distance of a query fingerprint.
+
+    Fingerprints are split into threshold + 1 blocks; two fingerprints
+    within threshold bits of each other must agree on at least one whole
+    block, so only fingerprints sharing a block are compared.
+    """
+
+    def __init__(self, threshold, maxsize=None):
+        """Set the max Hamming distance of a match and max number of entries."""
+        if not 0 <= threshold < FINGERPRINT_BITS // 2:
+            raise ValueError(
+                "Near-duplicate threshold must be between 0 and {0}.".format(
+                    FINGERPRINT_BITS // 2 - 1
+                )
+            )
+        self.threshold = threshold
+        self.maxsize = maxsize
+        num_blocks = threshold + 1
+        block_size = FINGERPRINT_BITS // num_blocks
+        self.blocks = []  # (shift, mask) of each block
+        for i in range(num_blocks):
+            shift = i * block_size
+            size = block_size if i < num_blocks - 1 else FINGERPRINT_BITS - shift
+            self.blocks.append((shift, (1 << size) - 1))
+        self.tables = [{} for _ in self.blocks]  # block value --> fingerprints
+        self.fingerprints = deque()  # In insertion order, for eviction
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def find(self, fingerprint):
+        """Return an indexed fingerprint near fingerprint, or None."""
+        for (shift, mask), table in zip(self.blocks, self.tables):
+            for candidate in table.get(fingerprint >> shift & mask, ()):
+                if hamming_distance(fingerprint, candidate) <= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, fingerprint):
+        """Index a fingerprint, evicting the oldest one if full."""
+        self.fingerprints.append(fingerprint)
+        for (shift, mask), table in zip(self.blocks, self.tables):
+            table.setdefault(fingerprint >> shift & mask, []).append(fingerprint)
+
+        if self.maxsize is not None and len(self.fingerprints) > self.maxsize:
+            oldest = self.fingerprints.popleft()
+            for (shift, mask), table in zip(self.blocks, self.tables):
+                key = oldest >> shift & mask
+                bucket = table[key]
+                bucket.remove(oldest)
+                if not bucket:
+                    del table[key]
@@ -0,0 +1,101 @@
+"""Incremental parsing of HTML read in chunks, for pages too big for a DOM.
+
+Responses are spooled to temporary files as they download, and parsed
+by feeding the parser one chunk at a time. Only the part of the tree
+still being parsed is kept, so memory use depends on the chunk size and
+the size of the XPath matches rather than on the size of the page.
+"""
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024  # Bytes of a response kept in memory before disk
+
+
+def is_stream(raw_html):
+    """Return whether raw HTML is a file object rather than a string."""
+    return hasattr(raw_html, "read")
+
+
+def iter_chunks(infile, chunk_size=CHUNK_SIZE):
+    """Read a file object from the start, one chunk at a time."""
+    infile.seek(0)
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_xpath_matches(chunks, xpath):
+    """Yield the elements selected by an XPath as they finish parsing.
+
+    Keyword arguments:
+    chunks -- pieces of HTML content (iterable of str)
+    xpath -- an XPath expression selecting elements (str)
+
+    Each element is checked against the XPath when its start tag is
+    parsed, and yielded whole once its end tag is parsed. Elements that
+    are not inside a match are discarded as soon as they end, so the XPath
+    can only depend on an element's attributes and ancestors, not on its
+    content or position among its siblings. The XPath is evaluated once
+    per chunk, over the little that is left of the tree plus the chunk.
+    Unlike lxml's xpath(), a match nested inside another match is not
+    yielded on its own, as it is already part of the outer match.
+    Yielded elements are cleared when the next one is requested.
+
+    Raise ValueError if the XPath selects no elements.
+    """
+    import lxml.etree
+
+    match = None  # The matching element currently being parsed
+    num_matches = 0
+    for events in iter_parse_events(chunks):
+        results = None  # Elements of the tree parsed so far matching xpath
+        for event, elem in events:
+            if event == "start":
+                if match is None:
+                    if results is None:
+                        results = elem.getroottree().xpath(xpath)
+                        if not isinstance(results, list) or any(
+                            not isinstance(x, lxml.etree._Element) for x in results
+                        ):
+                            raise ValueError(
+                                "XPath should return an HtmlElement object."
+                            )
+                        results = set(results)
+                    if elem in results:
+                        match = elem
+                continue
+
+            if elem is match:
+                num_matches += 1
+                yield elem
+                match = None
+            if match is None:
+                # Discard the element and the siblings parsed before it
+                elem.clear()
+                parent = elem.getparent()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+    if not num_matches:
+        raise ValueError("XPath {0} returned no results.".format(xpath))
+
+
+def iter_parse_events(chunks):
+    """Feed chunks of HTML to a pull parser, yielding the events of each chunk.
+
+    Return an iterator of lists of (event, element) tuples.
+    """
+    import lxml.etree
+
+    parser = lxml.etree.HTMLPullParser(events=("start", "end"))
+    fed = False
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+            fed = True
+            yield list(parser.read_events())
+    if fed:
+        # Closing ends any elements left open at the end of the page
+        parser.close()
+        yield list(parser.read_events())
@@ -0,0 +1,122 @@
+"""Politeness limits for requests made to the same host."""
+
+from contextlib import contextmanager
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allows rate requests per second on average, in bursts of up to burst.
+
+    The bucket holds up to burst tokens and refills at rate tokens per
+    second. Each request takes one token.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Return seconds until a token is available, 0 if one is now."""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class HostScheduler(object):
+    """Limits the rate and concurrency of requests to each host.
+
+    Each host gets its own token bucket and its own count of requests in
+    flight, so requests to different hosts never wait on each other apart
+    from the overall concurrency limit. Threads waiting on a host are
+    woken in no particular order.
+    """
+
+    def __init__(self, rate=None, host_concurrency=None, concurrency=None):
+        """Set the limits on requests.
+
+        Keyword arguments:
+        rate -- max requests per second to a host, or None for no limit (float)
+        host_concurrency -- max requests in flight to a host, or None (int)
+        concurrency -- max requests in flight overall, or None (int)
+        """
+        self.rate = rate
+        self.host_concurrency = host_concurrency
+        self.concurrency = concurrency
+        self.cond = threading.Condition()
+        self.buckets = {}  # host --> TokenBucket of its rate limit
+        self.delays = {}  # host --> min seconds between its requests
+        self.active = {}  # host --> number of its requests in flight
+        self.num_active = 0
+
+    def set_delay(self, host, delay):
+        """Space out requests to a host by at least delay seconds."""
+        with self.cond:
+            self.delays[host] = delay
+            self.buckets.pop(host, None)
+
+    def get_bucket(self, host):
+        """Get the token bucket of host, or None if its rate is unlimited."""
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            # Bursts are only as large as the requests allowed in flight
+            rate, burst = self.rate, self.host_concurrency or 1
+            delay = self.delays.get(host)
+            if delay:
+                rate, burst = min(rate or float("inf"), 1.0 / delay), 1
+            if rate is None:
+                return None
+            bucket = self.buckets[host] = TokenBucket(rate, burst)
+        return bucket
+
+    def is_full(self, host):
+        """Return whether a concurrency limit stops a request to host."""
+        if self.concurrency and self.num_active >= self.concurrency:
+            return True
+        return bool(
+            self.host_concurrency and self.active.get(host, 0) >= self.host_concurrency
+        )
+
+    def acquire(self, host):
+        """Block until a request to host is allowed, then count it in flight."""
+        with self.cond:
+            while True:
+                timeout = None
+                if not self.is_full(host):
+                    bucket = self.get_bucket(host)
+                    timeout = bucket.delay(time.time()) if bucket else 0
+                    if not timeout:
+                        if bucket:
+                            bucket.take()
+                        break
+                self.cond.wait(timeout)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.num_active += 1
+
+    def release(self, host):
+        """Count a request to host as finished."""
+        with self.cond:
+            self.active[host] -= 1
+            if not self.active[host]:
+                del self.active[host]
+            self.num_active -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, host):
+        """Hold a request slot for host while the with block runs."""
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
@@ -12,34 +12,30 @@
 """
 
 from __future__ import print_function
+from collections import deque
+from contextlib import contextmanager
 import glob
 import hashlib
+import io
 import os
 import random
 import re
 import shutil
+import sqlite3
 import string
 import sys
-import time
+import tempfile
+import threading
 
-import lxml.html as lh
-
-try:
-    import pdfkit as pk
-except ImportError:
-    pass
-import requests
-from requests.exceptions import MissingSchema
 from six import PY2
-from six.moves import input, xrange as range
+from six.moves import input
 from six.moves.urllib.parse import urlparse, urljoin
-from six.moves.urllib.request import getproxies
-import tldextract
 
-if PY2:
-    from cgi import escape
-else:
-    from html import escape
+from . import throttle
+from .domains import DomainExtractor
+from .manifest import PartManifest
+from .refilter import RegexFilter
+from .streaming import is_stream, iter_chunks, iter_xpath_matches
 
 USER_AGENTS = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.7; rv:11.0) "
@@ -59,7 +55,31 @@ XDG_CACHE_DIR = os.environ.get(
     "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
 )
 CACHE_DIR = os.path.join(XDG_CACHE_DIR, "scrape")
+# Cache file of the requests_cache cache used by older versions
 CACHE_FILE = os.path.join(CACHE_DIR, "cache{0}".format("" if PY2 else "3"))
+RESPONSE_CACHE = None  # cache.ResponseCache used by new sessions, if enabled
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+PARSE_COUNT = 0  # Number of HTML documents parsed by parse_raw_html
+# ASCII characters that are not in string.printable, as bytes to delete
+NONPRINTABLE_BYTES = bytes(x for x in range(128) if chr(x) not in string.printable)
+# The same characters plus C1 control characters, for non-ASCII text
+CONTROL_CHARS_RE = re.compile(
+    "[{0}\x80-\x9f]".format(re.escape(NONPRINTABLE_BYTES.decode("ascii")))
+)
+
+DOMAIN_EXTRACTOR = DomainExtractor()
+
+REGEX_FILTERS = {}  # Tuple of regexps --> RegexFilter compiled from them
+MANIFESTS = {}  # Directory --> PartManifest of PART.html files written there
+PAGE_STORES = {}  # Directory --> PageStore of pages stored there
+PAGE_STORE_DIRNAME = "PART_pages"
+
+IMAGE_WORKERS = 8
+IMAGE_HOST_INTERVAL = 0.25  # Seconds between image requests to a host
+IMAGE_SCHEDULER = throttle.HostScheduler(1.0 / IMAGE_HOST_INTERVAL)
 
 # Web requests and requests caching functions
 #
@@ -67,6 +87,8 @@ CACHE_FILE = os.path.join(CACHE_DIR, "cache{0}".format("" if PY2 else "3"))
 
 def get_proxies():
     """Get available proxies to use with requests library."""
+    from six.moves.urllib.request import getproxies
+
     proxies = getproxies()
     filtered_proxies = {}
     for key, value in proxies.items():
@@ -78,52 +100,236 @@ def get_proxies():
     return filtered_proxies
 
 
+def init_session(pool_size=None):
+    """Create the HTTP session shared by all fetches, replacing any old one.
+
+    Proxies are resolved once here rather than on every request.
+    """
+    global SESSION
+    from .session import DEFAULT_POOL_SIZE, new_session
+
+    with SESSION_LOCK:
+        if SESSION is not None:
+            SESSION.close()
+        SESSION = new_session(
+            pool_size or DEFAULT_POOL_SIZE, get_proxies(), RESPONSE_CACHE
+        )
+    return SESSION
+
+
+def get_session():
+    """Get the shared HTTP session, creating it on first use."""
+    global SESSION
+    from .session import DEFAULT_POOL_SIZE, new_session
+
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = new_session(DEFAULT_POOL_SIZE, get_proxies(), RESPONSE_CACHE)
+        return SESSION
+
+
 def get_resp(url):
     """Get webpage response as an lxml.html.HtmlElement object."""
+    from requests.exceptions import MissingSchema
+
     try:
         headers = {"User-Agent": random.choice(USER_AGENTS)}
         try:
-            request = requests.get(url, headers=headers, proxies=get_proxies())
+            request = get_session().get(url, headers=headers)
         except MissingSchema:
             url = add_protocol(url)
-            request = requests.get(url, headers=headers, proxies=get_proxies())
-        return lh.fromstring(request.text.encode("utf-8") if PY2 else request.text)
+            request = get_session().get(url, headers=headers)
+        return parse_raw_html(request.text.encode("utf-8") if PY2 else request.text)
     except Exception:
         sys.stderr.write("Failed to retrieve {0}.\n".format(url))
         raise
 
 
+def request_page(url, headers=None, stream=False):
+    """Send a GET request for a webpage with a random User-Agent.
+
+    Return the response (requests.Response).
+    """
+    from requests.exceptions import MissingSchema
+
+    headers = dict(headers or {}, **{"User-Agent": random.choice(USER_AGENTS)})
+    try:
+        return get_session().get(url, headers=headers, stream=stream)
+    except MissingSchema:
+        url = add_protocol(url)
+        return get_session().get(url, headers=headers, stream=stream)
+
+
 def get_raw_resp(url):
     """Get webpage response as a unicode string."""
     try:
-        headers = {"User-Agent": random.choice(USER_AGENTS)}
-        try:
-            request = requests.get(url, headers=headers, proxies=get_proxies())
-        except MissingSchema:
-            url = add_protocol(url)
-            request = requests.get(url, headers=headers, proxies=get_proxies())
+        request = request_page(url)
         return request.text.encode("utf-8") if PY2 else request.text
     except Exception:
         sys.stderr.write("Failed to retrieve {0} as str.\n".format(url))
         raise
 
 
-def enable_cache():
-    """Enable requests library cache."""
+def spool_resp(request):
+    """Download a streamed response to a temporary file, one chunk at a time.
+
+    The file is kept in memory until it outgrows streaming.SPOOL_SIZE, so
+    the whole response is never held in memory as a string.
+    """
+    from .streaming import CHUNK_SIZE, SPOOL_SIZE
+
+    with request:
+        if request.encoding is None:
+            request.encoding = "utf-8"
+        raw_resp = tempfile.SpooledTemporaryFile(
+            SPOOL_SIZE, mode="w+", encoding="utf-8", newline=""
+        )
+        for chunk in request.iter_content(CHUNK_SIZE, decode_unicode=True):
+            raw_resp.write(chunk)
+    raw_resp.seek(0)
+    return raw_resp
+
+
+def stream_raw_resp(url):
+    """Get webpage response as a temporary file, downloaded in chunks."""
     try:
-        import requests_cache
-    except ImportError as err:
+        return spool_resp(request_page(url, stream=True))
+    except Exception:
+        sys.stderr.write("Failed to retrieve {0} as str.\n".format(url))
+        raise
+
+
+def get_modified_resp(url, etag=None, last_modified=None, stream=False):
+    """Get webpage response unless it is unchanged since it was last fetched.
+
+    Keyword arguments:
+    url -- the URL of the webpage (str)
+    etag -- the ETag header of the last response, if any (str)
+    last_modified -- the Last-Modified header of the last response, if any (str)
+    stream -- get the response as a file, as stream_raw_resp does (bool)
+
+    Return (raw_resp, etag, last_modified), where raw_resp is None if the
+    server answered 304 Not Modified, and the validators are those of the
+    new response, or the old ones if it sent none.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        request = request_page(url, headers, stream)
+        etag = request.headers.get("ETag", etag)
+        last_modified = request.headers.get("Last-Modified", last_modified)
+        if request.status_code == 304:
+            request.close()
+            return None, etag, last_modified
+        if stream:
+            return spool_resp(request), etag, last_modified
+        raw_resp = request.text.encode("utf-8") if PY2 else request.text
+        return raw_resp, etag, last_modified
+    except Exception:
+        sys.stderr.write("Failed to retrieve {0} as str.\n".format(url))
+        raise
+
+
+def get_raw_resps(urls, workers=1, stream=False):
+    """Get webpage responses for several URLs using a pool of threads.
+
+    Keyword arguments:
+    urls -- URLs to fetch, duplicates are only fetched once (list)
+    workers -- max number of URLs to fetch at once (int) (default: 1)
+    stream -- get responses as files with stream_raw_resp (bool) (default: False)
+
+    Return a dict mapping each URL to its response as a unicode string.
+    """
+    fetch = stream_raw_resp if stream else get_raw_resp
+    unique_urls = list(dict.fromkeys(urls))
+    if workers <= 1 or len(unique_urls) <= 1:
+        return {url: fetch(url) for url in unique_urls}
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(unique_urls))) as pool:
+        return dict(zip(unique_urls, pool.map(fetch, unique_urls)))
+
+
+def enable_cache(backend="sqlite", ttl=None, max_bytes=None):
+    """Enable the response cache for sessions created from now on.
+
+    Keyword arguments:
+    backend -- where to store responses, a key of cache.BACKENDS (str)
+    ttl -- seconds before a cached response expires (int)
+    max_bytes -- max compressed bytes cached before evicting (int)
+    """
+    global RESPONSE_CACHE
+    from . import cache
+
+    try:
+        RESPONSE_CACHE = cache.open_cache(
+            CACHE_DIR,
+            backend,
+            cache.DEFAULT_TTL if ttl is None else ttl,
+            cache.DEFAULT_MAX_BYTES if max_bytes is None else max_bytes,
+        )
+    except (OSError, IOError, sqlite3.Error) as err:
         sys.stderr.write("Failed to enable cache: {0}\n".format(str(err)))
-        return
-    if not os.path.exists(CACHE_DIR):
-        os.makedirs(CACHE_DIR)
-    requests_cache.install_cache(CACHE_FILE)
+
+
+def close_cache():
+    """Close the response cache, writing the times responses were last used."""
+    global RESPONSE_CACHE
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.close()
+        RESPONSE_CACHE = None
+
+
+def print_cache_stats():
+    """Print the hit rates of the response and domain caches.
+
+    The bytes the response cache saved are printed along with its hit rate.
+    """
+    if RESPONSE_CACHE is None:
+        print("Response cache is disabled.")
+    else:
+        stats = RESPONSE_CACHE.stats
+        print(
+            "Response cache: {0} hits, {1} misses ({2:.1%} hit rate), "
+            "{3:.2f} MB saved, {4:.2f} MB cached.".format(
+                stats.hits,
+                stats.misses,
+                stats.hit_rate,
+                stats.bytes_saved / 1048576.0,
+                RESPONSE_CACHE.backend.size / 1048576.0,
+            )
+        )
+    domains = DOMAIN_EXTRACTOR.cache
+    print(
+        "Domain cache: {0} hits, {1} misses ({2:.1%} hit rate).".format(
+            domains.hits, domains.misses, DOMAIN_EXTRACTOR.hit_rate
+        )
+    )
 
 
 def clear_cache():
-    """Clear requests library cache."""
+    """Clear response cache, saved robots.txt files and validators."""
+    from .cache import BACKENDS, get_cache_filename
+    from .robots import get_cache_dir
+    from .validators import get_store_filename
+
     for cache in glob.glob("{0}*".format(CACHE_FILE)):
         os.remove(cache)
+    for backend in BACKENDS:
+        path = os.path.join(CACHE_DIR, get_cache_filename(backend))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    if os.path.exists(get_store_filename()):
+        os.remove(get_store_filename())
+    robots_dir = get_cache_dir()
+    if os.path.exists(robots_dir):
+        shutil.rmtree(robots_dir)
 
 
 # Document caching functions
@@ -137,88 +343,164 @@ def hash_text(text):
     return md5.hexdigest()
 
 
-def cache_page(page_cache, page_hash, cache_size):
-    """Add a page to the page cache."""
-    page_cache.append(page_hash)
-    if len(page_cache) > cache_size:
-        page_cache.pop(0)
+def cache_page(page_cache, page_hash):
+    """Add a page to the page cache (LRUCache), evicting the oldest if full."""
+    page_cache[page_hash] = True
+
+
+def cache_parsed_text(args, part, html, page_text=None):
+    """Keep the text of a page for the text, csv and print writers.
+
+    Keyword arguments:
+    args -- program arguments (dict)
+    part -- the Part recording the page's PART.html file (Part)
+    html -- parsed or unparsed HTML file content (lxml.html.HtmlElement, str
+            or file object)
+    page_text -- text parsed from html with no filters, if known (list)
+
+    This saves get_parsed_text from reading the PART.html file back and
+    parsing it a second time. Pages filtered by XPath are not cached, nor
+    are pages that would put more than args["max_memory"] MB in the cache
+    or pages of a resumable crawl, which must outlive the process.
+
+    Return whether the text was cached.
+    """
+    import lxml.html as lh
+
+    if args["xpath"] or not any(args[x] for x in ("print", "text", "csv")):
+        return False
+    if args["checkpoint_interval"] or args["resume"]:
+        return False
+    if page_text is None or args["filter"] or args["attributes"]:
+        if is_stream(html):
+            page_text = parse_text_stream(
+                html, None, args["filter"], args["attributes"], args["keep_unicode"]
+            )
+        else:
+            if not isinstance(html, lh.HtmlElement):
+                html = parse_raw_html(html)
+            page_text = parse_text(
+                html, None, args["filter"], args["attributes"], args["keep_unicode"]
+            )
+
+    manifest = get_manifest()
+    text_size = sum(len(line) for line in page_text)
+    if manifest.text_size + text_size > args["max_memory"] * 1024 * 1024:
+        return False
+    manifest.keep_text(part, page_text)
+    return True
 
 
 # Text processing functions
 #
 
 
+def get_regex_filter(regexps):
+    """Get a RegexFilter for regexps, compiling it only on first use."""
+    key = tuple(regexps)
+    if key not in REGEX_FILTERS:
+        REGEX_FILTERS[key] = RegexFilter(regexps)
+    return REGEX_FILTERS[key]
+
+
 def re_filter(text, regexps):
     """Filter text using regular expressions."""
     if not regexps:
         return text
+    return get_regex_filter(regexps)(text)
 
-    matched_text = []
-    compiled_regexps = [re.compile(x) for x in regexps]
-    for line in text:
-        if line in matched_text:
-            continue
-
-        for regexp in compiled_regexps:
-            found = regexp.search(line)
-            if found and found.group():
-                matched_text.append(line)
 
-    return matched_text or text
+def clean_whitespace(line):
+    """Collapse runs of whitespace in a line, turning blank lines into newlines."""
+    clean_line = " ".join(line.split())
+    if not clean_line:
+        clean_line = "\n"
+    return clean_line
 
 
-def remove_whitespace(text):
+def iter_remove_whitespace(text):
     """Remove unnecessary whitespace while keeping logical structure.
 
     Keyword arguments:
-    text -- text to remove whitespace from (list)
+    text -- text to remove whitespace from (iterable of str)
 
     Retain paragraph structure but remove other whitespace,
     such as between words on a line and at the start and end of the text.
+
+    Lines are yielded as they are cleaned, looking at most two lines ahead,
+    so the whole text is consumed in a single pass.
     """
-    clean_text = []
+    lines = iter(text)
+    ahead = deque()
+
+    def peek(num_lines):
+        """Read up to num_lines ahead, returning how many are available."""
+        while len(ahead) < num_lines:
+            try:
+                ahead.append(next(lines))
+            except StopIteration:
+                break
+        return len(ahead)
+
     curr_line = ""
     # Remove any newlines that follow two lines of whitespace consecutively
     # Also remove whitespace at start and end of text
-    while text:
+    while peek(1):
         if not curr_line:
             # Find the first line that is not whitespace and add it
-            curr_line = text.pop(0)
-            while not curr_line.strip() and text:
-                curr_line = text.pop(0)
+            curr_line = ahead.popleft()
+            while not curr_line.strip() and peek(1):
+                curr_line = ahead.popleft()
             if curr_line.strip():
-                clean_text.append(curr_line)
+                yield clean_whitespace(curr_line)
         else:
             # Filter the rest of the lines
-            curr_line = text.pop(0)
-            if not text:
+            curr_line = ahead.popleft()
+            if not peek(1):
                 # Add the final line if it is not whitespace
                 if curr_line.strip():
-                    clean_text.append(curr_line)
+                    yield clean_whitespace(curr_line)
                 continue
 
             if curr_line.strip():
-                clean_text.append(curr_line)
-            else:
+                yield clean_whitespace(curr_line)
+            elif ahead[0].strip():
+                yield clean_whitespace(curr_line)
+            elif peek(2) > 1 and ahead[1].strip():
                 # If the current line is whitespace then make sure there is
                 # no more than one consecutive line of whitespace following
-                if not text[0].strip():
-                    if len(text) > 1 and text[1].strip():
-                        clean_text.append(curr_line)
-                else:
-                    clean_text.append(curr_line)
+                yield clean_whitespace(curr_line)
 
-    # Now filter each individual line for extraneous whitespace
-    cleaner_text = []
-    for line in clean_text:
-        clean_line = " ".join(line.split())
-        if not clean_line.strip():
-            clean_line += "\n"
-        cleaner_text.append(clean_line)
-    return cleaner_text
 
+def remove_whitespace(text):
+    """Remove unnecessary whitespace while keeping logical structure.
 
-def parse_text(infile, xpath=None, filter_words=None, attributes=None):
+    Keyword arguments:
+    text -- text to remove whitespace from (list)
+
+    Return a list of the lines yielded by iter_remove_whitespace.
+    """
+    return list(iter_remove_whitespace(text))
+
+
+def remove_nonprintable(line, keep_unicode=False):
+    """Remove characters that are not in string.printable from a line.
+
+    If keep_unicode is True, only control characters are removed and
+    non-ASCII text is kept.
+    """
+    if keep_unicode:
+        return CONTROL_CHARS_RE.sub("", line)
+    return (
+        line.encode("ascii", "ignore")
+        .translate(None, NONPRINTABLE_BYTES)
+        .decode("ascii")
+    )
+
+
+def parse_text(
+    infile, xpath=None, filter_words=None, attributes=None, keep_unicode=False
+):
     """Filter text using XPath, regex keywords, and tag attributes.
 
     Keyword arguments:
@@ -226,9 +508,12 @@ def parse_text(infile, xpath=None, filter_words=None, attributes=None):
     xpath -- an XPath expression (str)
     filter_words -- regex keywords (list)
     attributes -- HTML tag attributes (list)
+    keep_unicode -- keep non-ASCII characters (bool) (default: False)
 
     Return a list of strings of text.
     """
+    import lxml.html as lh
+
     infiles = []
     text = []
     if xpath is not None:
@@ -264,9 +549,78 @@ def parse_text(infile, xpath=None, filter_words=None, attributes=None):
 
     if filter_words is not None:
         text = re_filter(text, filter_words)
+    return clean_text(text, keep_unicode)
+
+
+def parse_text_stream(
+    infile, xpath=None, filter_words=None, attributes=None, keep_unicode=False
+):
+    """Filter text like parse_text, parsing HTML from a file in chunks.
+
+    Keyword arguments:
+    infile -- HTML content to parse (file object)
+    xpath -- an XPath expression selecting elements (str)
+    filter_words -- regex keywords (list)
+    attributes -- HTML tag attributes (list)
+    keep_unicode -- keep non-ASCII characters (bool) (default: False)
+
+    No tree is built without an XPath, and with one only the matching
+    elements are kept, one at a time; see streaming.iter_xpath_matches.
+
+    Return a list of strings of text.
+    """
+    from .scanner import scan_html
+    from .streaming import iter_xpath_matches
+
+    if attributes is not None:
+        attributes = [clean_attr(x) for x in attributes]
+        attributes = [x for x in attributes if x]
+    else:
+        attributes = ["text()"]
+
+    if xpath is None:
+        page = scan_html(
+            infile,
+            link_tags=(),
+            attributes=[x[1:] for x in attributes if x.startswith("@")],
+        )
+        attr_text = [
+            page.text if x == "text()" else page.attributes[x[1:]] for x in attributes
+        ]
+    else:
+        import lxml.etree
+
+        attr_text = [[] for _ in attributes]
+        text_xpath = "descendant-or-self::*[not(self::script) and not(self::style)]"
+        # Plain strings, as lxml's "smart" strings keep their element alive
+        attr_xpaths = [
+            lxml.etree.XPath("{0}/{1}".format(text_xpath, x), smart_strings=False)
+            for x in attributes
+        ]
+        for elem in iter_xpath_matches(iter_chunks(infile), xpath):
+            for attr_xpath, new_text in zip(attr_xpaths, attr_text):
+                new_text += attr_xpath(elem)
+
+    text = []
+    for new_text in attr_text:
+        text += new_text
+    if filter_words is not None:
+        text = re_filter(text, filter_words)
+    return clean_text(text, keep_unicode)
+
+
+def clean_text(text, keep_unicode=False):
+    """Remove unnecessary whitespace and nonprintable characters from text.
+
+    Keyword arguments:
+    text -- raw text nodes of a page (iterable of str)
+    keep_unicode -- keep non-ASCII characters (bool) (default: False)
+
+    Return a list of strings of text.
+    """
     return [
-        "".join(x for x in line if x in string.printable)
-        for line in remove_whitespace(text)
+        remove_nonprintable(line, keep_unicode)
+        for line in iter_remove_whitespace(text)
         if line
     ]
 
@@ -280,10 +634,24 @@ def get_parsed_text(args, infilename):
 
     Return a list of strings of text.
     """
+    part = get_manifest().get(infilename)
+    if part is not None and part.in_memory:
+        return list(part.text)
+
+    if args["stream"] and infilename.endswith(".html"):
+        with open_part_file(infilename) as infile:
+            return parse_text_stream(
+                infile,
+                args["xpath"],
+                args["filter"],
+                args["attributes"],
+                args["keep_unicode"],
+            )
+
     parsed_text = []
     if infilename.endswith(".html"):
         # Convert HTML to lxml object for content parsing
-        html = lh.fromstring(read_files(infilename))
+        html = parse_raw_html(read_files(infilename))
         text = None
     else:
         html = None
@@ -291,10 +659,16 @@ def get_parsed_text(args, infilename):
 
     if html is not None:
         parsed_text = parse_text(
-            html, args["xpath"], args["filter"], args["attributes"]
+            html,
+            args["xpath"],
+            args["filter"],
+            args["attributes"],
+            args["keep_unicode"],
         )
     elif text is not None:
-        parsed_text = parse_text(text, args["xpath"], args["filter"])
+        parsed_text = parse_text(
+            text, args["xpath"], args["filter"], keep_unicode=args["keep_unicode"]
+        )
     else:
         if not args["quiet"]:
             sys.stderr.write("Failed to parse text from {0}.\n".format(infilename))
@@ -317,10 +691,21 @@ def clean_attr(attr):
     return None
 
 
+def parse_raw_html(raw_html):
+    """Parse HTML into an lxml.html.HtmlElement, counting it in PARSE_COUNT."""
+    import lxml.html as lh
+
+    global PARSE_COUNT
+    PARSE_COUNT += 1
+    return lh.fromstring(raw_html)
+
+
 def parse_html(infile, xpath):
     """Filter HTML using XPath."""
+    import lxml.html as lh
+
     if not isinstance(infile, lh.HtmlElement):
-        infile = lh.fromstring(infile)
+        infile = parse_raw_html(infile)
     infile = infile.xpath(xpath)
     if not infile:
         raise ValueError("XPath {0} returned no results.".format(xpath))
@@ -333,7 +718,7 @@ def parse_html(infile, xpath):
 
 def get_domain(url):
     """Get the domain of a URL using tldextract."""
-    return tldextract.extract(url).domain
+    return DOMAIN_EXTRACTOR.domain(url)
 
 
 def add_protocol(url):
@@ -380,7 +765,7 @@ def clean_url(url, base_url=None):
 
 def has_suffix(url):
     """Return whether the url has a suffix using tldextract."""
-    return bool(tldextract.extract(url).suffix)
+    return bool(DOMAIN_EXTRACTOR.suffix(url))
 
 
 def add_url_suffix(url):
@@ -529,6 +914,14 @@ def write_pdf_files(args, infilenames, outfilename):
     infilenames -- names of user-inputted and/or downloaded files (list)
     outfilename -- name of output pdf file (str)
     """
+    import lxml.html as lh
+
+    try:
+        import pdfkit as pk
+    except ImportError as err:
+        sys.stderr.write("Failed to write pdf files: {0}\n".format(str(err)))
+        return False
+
     if not outfilename.endswith(".pdf"):
         outfilename = outfilename + ".pdf"
     outfilename = overwrite_file_check(args, outfilename)
@@ -561,7 +954,8 @@ def write_pdf_files(args, infilenames, outfilename):
                 else:
                     pk.from_string(lh.tostring(html), outfilename, options=options)
             else:
-                pk.from_file(infilename, outfilename, options=options)
+                with stored_pages_as_files([infilename]) as filenames:
+                    pk.from_file(filenames[0], outfilename, options=options)
         elif args["single"]:
             if not args["quiet"]:
                 print(
@@ -589,7 +983,8 @@ def write_pdf_files(args, infilenames, outfilename):
                 else:
                     pk.from_string(lh.tostring(html), outfilename, options=options)
             else:
-                pk.from_file(infilenames, outfilename, options=options)
+                with stored_pages_as_files(infilenames) as filenames:
+                    pk.from_file(filenames, outfilename, options=options)
         return True
     except (OSError, IOError) as err:
         sys.stderr.write(
@@ -691,7 +1086,7 @@ def write_file(data, outfilename):
     if not data:
         return False
     try:
-        with open(outfilename, "w") as outfile:
+        with open(outfilename, "w", encoding="utf-8") as outfile:
             for line in data:
                 if line:
                     outfile.write(line)
@@ -703,13 +1098,99 @@ def write_file(data, outfilename):
         return False
 
 
+def get_manifest():
+    """Get the PartManifest of the current directory."""
+    dirname = os.getcwd()
+    if dirname not in MANIFESTS:
+        MANIFESTS[dirname] = PartManifest(dirname)
+    return MANIFESTS[dirname]
+
+
+def get_page_store(create=False):
+    """Get the PageStore of the current directory opened by this run.
+
+    Return None if this run has not opened one, unless create is True, in
+    which case the store is opened, or created if it does not exist.
+    """
+    from .pagestore import PageStore
+
+    dirname = os.path.join(os.getcwd(), PAGE_STORE_DIRNAME)
+    if dirname not in PAGE_STORES:
+        if not create:
+            return None
+        PAGE_STORES[dirname] = PageStore(dirname)
+    return PAGE_STORES[dirname]
+
+
+def get_stored_part(filename):
+    """Get the Part of a PART.html filename if its page is in the page store."""
+    part = get_manifest().get(filename)
+    if part is None or part.in_memory:
+        return None
+    store = get_page_store()
+    if store is None or part.num not in store:
+        return None
+    return part
+
+
+@contextmanager
+def stored_pages_as_files(filenames):
+    """Write the pages of the page store among filenames to temporary files.
+
+    Return the filenames with those of stored pages replaced by their
+    temporary files, which are removed when the with block ends. Stored
+    pages link to their images by absolute paths, so they render the same
+    from any directory.
+    """
+    infilenames = []
+    tmp_filenames = []
+    try:
+        for filename in filenames:
+            part = get_stored_part(filename)
+            if part is None:
+                infilenames.append(filename)
+                continue
+            handle, tmp_filename = tempfile.mkstemp(prefix="PART", suffix=".html")
+            tmp_filenames.append(tmp_filename)
+            with io.open(handle, "w", encoding="utf-8") as outfile:
+                for chunk in get_page_store().iter_chunks(part.num):
+                    outfile.write(chunk)
+            infilenames.append(tmp_filename)
+        yield infilenames
+    finally:
+        for tmp_filename in tmp_filenames:
+            remove_file(tmp_filename)
+
+
 def get_num_part_files():
-    """Get the number of PART.html files currently saved to disk."""
-    num_parts = 0
-    for filename in os.listdir(os.getcwd()):
-        if filename.startswith("PART") and filename.endswith(".html"):
-            num_parts += 1
-    return num_parts
+    """Get the number of PART.html files written to the current directory."""
+    return len(get_manifest())
+
+
+def get_image_filename(img_url):
+    """Get the local filename of an image from its URL."""
+    img_name = img_url.split("/")[-1]
+    if "?" in img_name:
+        img_name = img_name.split("?")[0]
+    if not os.path.splitext(img_name)[1]:
+        img_name = "{0}.jpeg".format(img_name)
+    return img_name
+
+
+def write_image(img_url, full_img_name, headers):
+    """Download an image to disk, waiting on the rate limit of its host.
+
+    Return whether the image was saved.
+    """
+    try:
+        with IMAGE_SCHEDULER.slot(urlparse(img_url).netloc):
+            resp = get_session().get(img_url, headers=headers)
+        resp.raise_for_status()
+        with open(full_img_name, "wb") as img:
+            img.write(resp.content)
+        return True
+    except (OSError, IOError):
+        return False
 
 
 def write_part_images(url, raw_html, html, filename):
@@ -721,66 +1202,137 @@ def write_part_images(url, raw_html, html, filename):
     html -- parsed HTML file content (lxml.html.HtmlElement) (default: None)
     filename -- the PART.html filename (str)
 
+    Each distinct image is downloaded once, with up to IMAGE_WORKERS
+    downloads in flight and requests to each host spaced out by
+    IMAGE_HOST_INTERVAL seconds.
+
     Return raw HTML with image names replaced with local image filenames.
     """
     save_dirname = "{0}_files".format(os.path.splitext(filename)[0])
     if not os.path.exists(save_dirname):
         os.makedirs(save_dirname)
-    images = html.xpath("//img/@src")
-    internal_image_urls = [x for x in images if x.startswith("/")]
 
-    headers = {"User-Agent": random.choice(USER_AGENTS)}
-    for img_url in images:
-        img_name = img_url.split("/")[-1]
-        if "?" in img_name:
-            img_name = img_name.split("?")[0]
-        if not os.path.splitext(img_name)[1]:
-            img_name = "{0}.jpeg".format(img_name)
+    # Map each distinct image src to its absolute URL and local filename,
+    # giving images with the same name at different URLs distinct filenames
+    images = {}
+    img_names = set()
+    for img_url in html.xpath("//img/@src"):
+        if img_url not in images:
+            img_name = get_image_filename(img_url)
+            while img_name in img_names:
+                img_name = modify_filename_id(img_name)
+            img_names.add(img_name)
+            images[img_url] = (
+                urljoin(url, img_url),
+                os.path.join(save_dirname, img_name),
+            )
+    if not images:
+        return raw_html
 
-        try:
-            full_img_name = os.path.join(save_dirname, img_name)
-            with open(full_img_name, "wb") as img:
-                if img_url in internal_image_urls:
-                    # Internal images need base url added
-                    full_img_url = "{0}{1}".format(url.rstrip("/"), img_url)
-                else:
-                    # External image
-                    full_img_url = img_url
-                img_content = requests.get(
-                    full_img_url, headers=headers, proxies=get_proxies()
-                ).content
-                img.write(img_content)
-                raw_html = raw_html.replace(escape(img_url), full_img_name)
-        except (OSError, IOError):
-            pass
-        time.sleep(random.uniform(0, 0.5))  # Slight delay between downloads
+    from concurrent.futures import ThreadPoolExecutor
+
+    if PY2:
+        from cgi import escape
+    else:
+        from html import escape
+
+    headers = {"User-Agent": random.choice(USER_AGENTS)}
+    with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, len(images))) as pool:
+        downloads = [
+            pool.submit(write_image, full_img_url, full_img_name, headers)
+            for full_img_url, full_img_name in images.values()
+        ]
+        for img_url, download in zip(images, downloads):
+            if download.result():
+                raw_html = raw_html.replace(escape(img_url), images[img_url][1])
     return raw_html
 
 
-def write_part_file(args, url, raw_html, html=None, part_num=None):
+def discard_part(part):
+    """Forget a part whose page was not saved, unless its text is in memory."""
+    if not part.in_memory:
+        get_manifest().remove(part.filename)
+        remove_file(part.filename)
+
+
+def write_part_file(
+    args, url, raw_html, html=None, part_num=None, page_text=None
+):
     """Write PART.html file(s) to disk, images in PART_files directory.
 
     Keyword arguments:
     args -- program arguments (dict)
-    raw_html -- unparsed HTML file content (list)
+    raw_html -- unparsed HTML file content (list), or a file from
+                stream_raw_resp, which is saved without images
     html -- parsed HTML file content (lxml.html.HtmlElement) (default: None)
-    part_num -- PART(#).html file number (int) (default: None)
+              if None, raw_html is only parsed when XPath, images or an
+              unfiltered text cache need it
+    part_num -- PART(#).html file number (int) (default: next free number)
+    page_text -- text parsed from html with no filters (list) (default: None)
+
+    With args["page_store"], pages are written to the PageStore of the
+    current directory instead of PART.html files, unless saving as HTML.
     """
-    if part_num is None:
-        part_num = get_num_part_files() + 1
-    filename = "PART{0}.html".format(part_num)
+    import lxml.html as lh
+
+    # Empty pages are not recorded, so they are never read back
+    if not raw_html and not is_stream(raw_html):
+        return
+
+    part = get_manifest().new_part(url, part_num)
+    filename = part.filename
+    store = None
+    if args["page_store"] and not args["html"]:
+        store = get_page_store(create=True)
 
     # Decode bytes to string in Python 3 versions
     if not PY2 and isinstance(raw_html, bytes):
         raw_html = raw_html.encode("ascii", "ignore")
 
+    # Text output is read from memory, so only write the page to disk for
+    # pdf or HTML output, or if it did not fit in memory
+    if cache_parsed_text(
+        args, part, html if html is not None else raw_html, page_text
+    ):
+        if not args["pdf"] and not args["html"]:
+            return
+
+    # Streamed responses are saved as downloaded, one chunk at a time
+    if is_stream(raw_html):
+        page = raw_html
+        if args["xpath"]:
+            page = (
+                lh.tostring(elem, encoding="unicode")
+                for elem in iter_xpath_matches(iter_chunks(raw_html), args["xpath"])
+            )
+        try:
+            if store is not None:
+                size = store.put(part.num, url, page)
+                if not part.in_memory:
+                    part.size = size
+                return
+            with open(filename, "w") as part_file:
+                for chunk in iter_chunks(page) if is_stream(page) else page:
+                    part_file.write(chunk)
+                if not part.in_memory:
+                    part.size = part_file.tell()
+        except ValueError:
+            # The XPath selected nothing, so there is no page to record
+            discard_part(part)
+            raise
+        return
+
     # Convert html to an lh.HtmlElement object for parsing/saving images
-    if html is None:
-        html = lh.fromstring(raw_html)
+    if html is None and (args["xpath"] or args["pdf"] or args["html"]):
+        html = parse_raw_html(raw_html)
 
     # Parse HTML if XPath entered
     if args["xpath"]:
-        raw_html = parse_html(html, args["xpath"])
+        try:
+            raw_html = parse_html(html, args["xpath"])
+        except ValueError:
+            discard_part(part)
+            raise
         if isinstance(raw_html, list):
             if not isinstance(raw_html[0], lh.HtmlElement):
                 raise ValueError("XPath should return an HtmlElement object.")
@@ -791,36 +1343,54 @@ def write_part_file(args, url, raw_html, html=None, part_num=None):
     # Write HTML and possibly images to disk
     if raw_html:
         if not args["no_images"] and (args["pdf"] or args["html"]):
-            raw_html = write_part_images(url, raw_html, html, filename)
-        with open(filename, "w") as part:
+            # Stored pages are not read from this directory, so their
+            # images are linked to by absolute paths
+            img_filename = filename if store is None else os.path.abspath(filename)
+            raw_html = write_part_images(url, raw_html, html, img_filename)
+        part_file = open(filename, "w") if store is None else io.StringIO()
+        with part_file:
             if not isinstance(raw_html, list):
                 raw_html = [raw_html]
                 if isinstance(raw_html[0], lh.HtmlElement):
                     for elem in raw_html:
-                        part.write(lh.tostring(elem))
+                        part_file.write(lh.tostring(elem))
                 else:
                     for line in raw_html:
-                        part.write(line)
+                        part_file.write(line)
+            if store is None:
+                size = part_file.tell()
+            else:
+                size = store.put(part.num, url, part_file.getvalue())
+            if not part.in_memory:
+                part.size = size
 
 
 def get_part_filenames(num_parts=None, start_num=0):
-    """Get numbered PART.html filenames."""
-    if num_parts is None:
-        num_parts = get_num_part_files()
-    return ["PART{0}.html".format(i) for i in range(start_num + 1, num_parts + 1)]
+    """Get PART.html filenames of parts start_num to num_parts of the manifest."""
+    return get_manifest().filenames(start_num, num_parts)
 
 
 def read_files(filenames):
-    """Read a file into memory."""
+    """Read a file, or a page of the page store, into memory."""
     if isinstance(filenames, list):
         for filename in filenames:
-            with open(filename, "r") as infile:
-                return infile.read()
+            return read_files(filename)
     else:
+        part = get_stored_part(filenames)
+        if part is not None:
+            return get_page_store().get(part.num)
         with open(filenames, "r") as infile:
             return infile.read()
 
 
+def open_part_file(filename):
+    """Open a file, or a page of the page store, for reading in chunks."""
+    part = get_stored_part(filename)
+    if part is not None:
+        return get_page_store().open(part.num)
+    return open(filename, "r")
+
+
 def remove_part_images(filename):
     """Remove PART(#)_files directory containing images from disk."""
     dirname = "{0}_files".format(os.path.splitext(filename)[0])
@@ -829,11 +1399,18 @@ def remove_part_images(filename):
 
 
 def remove_part_files(num_parts=None):
-    """Remove PART(#).html files and image directories from disk."""
-    filenames = get_part_filenames(num_parts)
-    for filename in filenames:
+    """Remove PART(#).html files, stored pages and image directories from disk."""
+    manifest = get_manifest()
+    store = get_page_store()
+    for filename in get_part_filenames(num_parts):
+        part = manifest.remove(filename)
+        if store is not None and part is not None:
+            store.remove(part.num)
         remove_part_images(filename)
         remove_file(filename)
+    if store is not None and not len(store):
+        store.destroy()
+        del PAGE_STORES[store.dirname]
 
 
 # User input and sanitation functions
@@ -0,0 +1,91 @@
+"""Validators of crawled pages, for incremental recrawls.
+
+For each page, keyed by its unique URL from canonical.canonicalize, the
+store keeps the ETag and Last-Modified headers of its last response, the
+hash of its text, its SimHash if near-duplicates were detected, and the
+links found on it. A recrawl sends the headers
+back as If-None-Match and If-Modified-Since, and when the server answers
+304 Not Modified, or the text hash is unchanged, the page's stored links
+are followed without parsing or saving the page again.
+"""
+
+from collections import namedtuple
+import json
+import os
+import sqlite3
+import threading
+
+from . import utils
+
+Validators = namedtuple(
+    "Validators", "etag last_modified fingerprint simhash links"
+)
+NOT_MODIFIED = object()  # Fetched in place of a page that is unchanged
+
+
+def get_store_filename():
+    """Get the filename of the validator store kept across runs."""
+    return os.path.join(utils.CACHE_DIR, "validators.db")
+
+
+class ValidatorStore(object):
+    """Validators of crawled pages kept in a SQLite database.
+
+    The store may be used from several threads at once.
+    """
+
+    def __init__(self, path=None):
+        """Open or create a validator store at path, or get_store_filename()."""
+        self.path = path or get_store_filename()
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, etag TEXT, "
+            "last_modified TEXT, fingerprint TEXT, simhash TEXT, links TEXT) "
+            "WITHOUT ROWID"
+        )
+
+    def get(self, key):
+        """Get the Validators of a unique URL, or None if it was never crawled."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified, fingerprint, simhash, links FROM pages "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, fingerprint, simhash, links = row
+        if simhash is not None:
+            simhash = int(simhash)  # Stored as text, as it may not fit in 63 bits
+        links = [tuple(link) for link in json.loads(links)]
+        return Validators(etag, last_modified, fingerprint, simhash, links)
+
+    def set(self, key, validators):
+        """Record the Validators of a unique URL."""
+        etag, last_modified, fingerprint, simhash, links = validators
+        if simhash is not None:
+            simhash = str(simhash)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    etag,
+                    last_modified,
+                    fingerprint,
+                    simhash,
+                    json.dumps(list(links)),
+                ),
+            )
+
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
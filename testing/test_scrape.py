@@ -2,12 +2,100 @@
 
 """Unit tests for scrape"""
 
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+import hashlib
+import io
 import os
+import posixpath
+import random
 import shutil
+import socketserver
+import string
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from urllib.parse import unquote
 
-from scrape import scrape, utils
+import lxml.html
+
+import scrape as scrape_package
+from scrape import cache, checkpoint, scrape, utils
+from scrape.canonical import canonicalize, canonicalize_links
+from scrape.crawler import Crawler
+from scrape.domains import DomainExtractor
+from scrape.frontier import MemoryFrontier, SQLiteFrontier, frontier_from_dict
+from scrape.lrucache import LRUCache
+from scrape.manifest import PartManifest
+from scrape.robots import RobotsCache
+from scrape.orderedset import OrderedSet
+from scrape.pagestore import PageStore
+from scrape.scanner import scan_html
+from scrape.streaming import iter_xpath_matches
+from scrape.simhash import SimHashIndex, hamming_distance, simhash
+from scrape.throttle import HostScheduler
+from scrape.validators import NOT_MODIFIED, ValidatorStore
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive between requests
+    disable_nagle_algorithm = True
+
+    def translate_path(self, path):
+        # Serve the server's site_dir rather than the working directory
+        path = posixpath.normpath(unquote(path.split("?")[0].split("#")[0]))
+        parts = [x for x in path.split("/") if x not in ("", os.curdir, os.pardir)]
+        return os.path.join(self.server.site_dir, *parts)
+
+    def do_GET(self):
+        self.server.user_agents[self.path] = self.headers.get("User-Agent")
+        SimpleHTTPRequestHandler.do_GET(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def write_site(site_dir, num_pages):
+    """Write a synthetic site where page i links to pages 2i and 2i+1"""
+    for i in range(1, num_pages + 1):
+        links = "".join(
+            '<a href="/page{0}.html">page {0}</a>'.format(x)
+            for x in (2 * i, 2 * i + 1)
+            if x <= num_pages
+        )
+        with open(os.path.join(site_dir, "page{0}.html".format(i)), "w") as page:
+            page.write(
+                "<html><body><p>Synthetic page {0}</p>{1}</body></html>".format(
+                    i, links
+                )
+            )
+
+
+def write_images(site_dir, num_images):
+    """Write placeholder image files to an img/ directory of a site"""
+    img_dir = os.path.join(site_dir, "img")
+    os.makedirs(img_dir)
+    for i in range(num_images):
+        with open(os.path.join(img_dir, "{0}.png".format(i)), "wb") as img:
+            img.write(b"image " + str(i).encode())
+
+
+def start_server(site_dir):
+    """Serve a directory over HTTP on a free local port in a daemon thread"""
+    server = ThreadingServer(("127.0.0.1", 0), QuietHandler)
+    server.site_dir = site_dir
+    server.user_agents = {}  # Path --> User-Agent it was last requested with
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
 
 
 class ScrapeTestCase(unittest.TestCase):
@@ -110,5 +198,1203 @@ class ScrapeTestCase(unittest.TestCase):
             self.assert_exists_and_rm(outfilename)
 
 
+def reference_remove_whitespace(text):
+    """The original list-popping remove_whitespace, kept as an oracle"""
+    clean_text = []
+    curr_line = ""
+    while text:
+        if not curr_line:
+            curr_line = text.pop(0)
+            while not curr_line.strip() and text:
+                curr_line = text.pop(0)
+            if curr_line.strip():
+                clean_text.append(curr_line)
+        else:
+            curr_line = text.pop(0)
+            if not text:
+                if curr_line.strip():
+                    clean_text.append(curr_line)
+                continue
+
+            if curr_line.strip():
+                clean_text.append(curr_line)
+            else:
+                if not text[0].strip():
+                    if len(text) > 1 and text[1].strip():
+                        clean_text.append(curr_line)
+                else:
+                    clean_text.append(curr_line)
+
+    cleaner_text = []
+    for line in clean_text:
+        clean_line = " ".join(line.split())
+        if not clean_line.strip():
+            clean_line += "\n"
+        cleaner_text.append(clean_line)
+    return cleaner_text
+
+
+class LazyImportTestCase(unittest.TestCase):
+    heavy_modules = (
+        "lxml",
+        "requests",
+        "tldextract",
+        "pdfkit",
+        "requests_cache",
+        "urllib.request",
+    )
+
+    def test_cli_import_defers_heavy_modules(self):
+        code = "import sys, scrape.scrape; print(' '.join(sorted(sys.modules)))"
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(scrape_package.__file__))
+        proc = subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            env=env,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        imported = set(proc.stdout.split())
+        for module in self.heavy_modules:
+            self.assertNotIn(module, imported)
+
+
+class CommandLineTestCase(unittest.TestCase):
+    def test_interrupt_exits_without_traceback(self):
+        argv = ["scrape", "http://example.com", "-t", "-ni"]
+        with mock.patch.object(sys, "argv", argv), mock.patch.dict(
+            os.environ, {"SCRAPE_DISABLE_CACHE": "1"}
+        ), mock.patch.object(scrape, "scrape", side_effect=KeyboardInterrupt):
+            with self.assertRaises(SystemExit) as context:
+                scrape.command_line_runner()
+        self.assertEqual(context.exception.code, 130)
+
+    def assert_rejected(self, options):
+        with mock.patch("sys.stderr"):
+            with self.assertRaises(SystemExit) as context:
+                scrape.get_parser().parse_args(options)
+        self.assertEqual(context.exception.code, 2)
+
+    def test_host_limits_must_be_positive(self):
+        for value in ("0", "-1", "nan"):
+            self.assert_rejected(["--rate", value])
+        for value in ("0", "-2", "1.5"):
+            self.assert_rejected(["--host-concurrency", value])
+        args = vars(scrape.get_parser().parse_args(["--rate", "0.5", "-hc", "2"]))
+        self.assertEqual((args["rate"], args["host_concurrency"]), (0.5, 2))
+
+    def test_combined_short_options_keep_their_meaning(self):
+        parser = scrape.get_parser()
+        combined = {
+            "-ci": {"crawl": ["i"]},
+            "-fr": {"filter": ["r"]},
+            "-in": {"images": True, "nonstrict": True},
+            "-mm": {"multiple": True},
+            "-ps": {"pdf": True, "single": True},
+            "-st": {"single": True, "text": True},
+        }
+        for option, expected in combined.items():
+            args = vars(parser.parse_args([option]))
+            for key, value in expected.items():
+                self.assertEqual(args[key], value, option)
+
+    def test_near_dup_threshold_range(self):
+        for value in ("-1", "32", "64"):
+            self.assert_rejected(["-nd", value])
+        for value in ("0", "31"):
+            args = vars(scrape.get_parser().parse_args(["-nd", value]))
+            self.assertEqual(args["near_dup_threshold"], int(value))
+
+    def test_stream_rejects_images(self):
+        argv = ["scrape", "http://example.com", "-t", "--stream", "-i"]
+        with mock.patch.object(sys, "argv", argv), mock.patch.dict(
+            os.environ, {"SCRAPE_DISABLE_CACHE": "1"}
+        ), mock.patch.object(scrape, "scrape") as scrape_mock:
+            with self.assertRaises(SystemExit) as context:
+                with mock.patch("sys.stderr"):
+                    scrape.command_line_runner()
+        self.assertEqual(context.exception.code, 2)
+        self.assertFalse(scrape_mock.called)
+
+
+class RemoveWhitespaceTestCase(unittest.TestCase):
+    def assert_same_as_reference(self, text):
+        expected = reference_remove_whitespace(list(text))
+        self.assertEqual(utils.remove_whitespace(list(text)), expected)
+        self.assertEqual(list(utils.iter_remove_whitespace(iter(text))), expected)
+
+    def test_html_corpus(self):
+        for filename in os.listdir(os.getcwd()):
+            if filename.endswith(".html"):
+                html = lxml.html.fromstring(utils.read_files(filename))
+                self.assert_same_as_reference(html.xpath("//text()"))
+
+    def test_random_corpus(self):
+        rand = random.Random(0)
+        pieces = ["", " ", "\n", " \t\n ", "word", " two  words ", "\nline\n"]
+        for _ in range(2000):
+            length = rand.randint(0, 12)
+            self.assert_same_as_reference(
+                [rand.choice(pieces) for _ in range(length)]
+            )
+
+
+class RemoveNonprintableTestCase(unittest.TestCase):
+    line = "Cr\xe8me br\xfbl\xe9e\x07\tcaf\xe9\x85 \u65e5\u672c\r\n"
+
+    def test_matches_string_printable(self):
+        expected = "".join(x for x in self.line if x in string.printable)
+        self.assertEqual(utils.remove_nonprintable(self.line), expected)
+
+    def test_keep_unicode(self):
+        self.assertEqual(
+            utils.remove_nonprintable(self.line, keep_unicode=True),
+            "Cr\xe8me br\xfbl\xe9e\tcaf\xe9 \u65e5\u672c\r\n",
+        )
+
+
+class DomainExtractorTestCase(unittest.TestCase):
+    def test_extracts_offline_and_caches_by_netloc(self):
+        extractor = DomainExtractor()
+        self.assertEqual(extractor.domain("http://forums.bbc.co.uk/a"), "bbc")
+        self.assertEqual(extractor.suffix("forums.bbc.co.uk/b"), "co.uk")
+        self.assertEqual(extractor.domain("127.0.0.1:8000"), "127.0.0.1")
+        self.assertEqual(extractor.suffix("localhost"), "")
+        self.assertEqual((extractor.cache.hits, extractor.cache.misses), (1, 3))
+        self.assertEqual(extractor.hit_rate, 0.25)
+
+    def test_uses_bundled_suffix_list_only(self):
+        import tldextract
+
+        with mock.patch.object(tldextract, "TLDExtract") as tld_extract:
+            DomainExtractor().domain("http://a.example.com/")
+        tld_extract.assert_called_once_with(cache_dir=None, suffix_list_urls=())
+
+    def test_cache_stats_print_hit_rate(self):
+        extractor = DomainExtractor()
+        for url in ("http://a.example.com/1", "http://a.example.com/2"):
+            extractor.domain(url)
+        with mock.patch.object(utils, "DOMAIN_EXTRACTOR", extractor), mock.patch(
+            "sys.stdout", new_callable=io.StringIO
+        ) as stdout:
+            utils.print_cache_stats()
+        self.assertIn(
+            "Domain cache: 1 hits, 1 misses (50.0% hit rate).", stdout.getvalue()
+        )
+
+
+class CanonicalTestCase(unittest.TestCase):
+    def test_fetch_urls_match_clean_url(self):
+        base_url = "http://www.example.com/dir/page"
+        hrefs = [
+            "http://www.example.com/a?x=1#top",
+            "https://other.org/b/",
+            "c.html",
+            "/d?y=2&x=1",
+            "?page=2",
+            "#frag",
+            "mailto:me@example.com",
+            "javascript:void(0)",
+            "//cdn.example.com/e.js",
+        ]
+        expected = [
+            utils.clean_url(href, base_url)
+            for href in hrefs
+            if utils.check_protocol(utils.clean_url(href, base_url))
+        ]
+        links = canonicalize_links(hrefs, base_url)
+        self.assertEqual([url for url, _ in links], expected)
+
+    def test_equivalent_urls_share_a_key(self):
+        urls = [
+            "http://www.Example.com/x?b=1&a=2",
+            "https://example.com/x?a=2&b=1#top",
+            "http://example.com/x?a=2&b=1/",
+        ]
+        keys = set(canonicalize(url)[1] for url in urls)
+        self.assertEqual(keys, set(["example.com/x?a=2&b=1"]))
+        self.assertIsNone(canonicalize("ftp://example.com/x"))
+
+
+class ScannerTestCase(unittest.TestCase):
+    def test_html_corpus_matches_dom(self):
+        for filename in os.listdir(os.getcwd()):
+            if filename.endswith(".html"):
+                raw_html = utils.read_files(filename)
+                html = lxml.html.fromstring(raw_html)
+                page = scan_html(raw_html, link_tags=("a", "area", "link"))
+                self.assertEqual(
+                    utils.clean_text(page.text), utils.parse_text(html)
+                )
+                self.assertEqual(
+                    page.links, html.xpath("//a/@href|//area/@href|//link/@href")
+                )
+
+    def test_skips_script_text_and_comments(self):
+        page = scan_html(
+            "<p>a &amp; b<!-- c -->d<script>var e</script>f<style>g</style></p>"
+        )
+        self.assertEqual(page.text, ["a & b", "d", "f"])
+
+    def test_crawler_filters_links(self):
+        raw_html = (
+            '<a href="/x1">1</a><a href="/y">2</a><a href="mailto:x@a.com">3</a>'
+            '<a href="http://b.com/x3">4</a><a href="/x1#top">5</a>'
+        )
+        parser = scrape.get_parser()
+        for crawl, expected in ((["x"], ["/x1", "/x1"]), (["z"], ["/x1", "/y", "/x1"])):
+            args = vars(parser.parse_args(["-c"] + crawl))
+            page = Crawler(args).scan_page("http://a.com/", raw_html)
+            self.assertEqual(
+                page.links, [canonicalize("http://a.com" + x) for x in expected]
+            )
+
+
+class StreamingTestCase(unittest.TestCase):
+    def test_html_corpus_matches_parse_text(self):
+        for filename in os.listdir(os.getcwd()):
+            if filename.endswith(".html"):
+                html = lxml.html.fromstring(utils.read_files(filename))
+                for attributes in (None, ["text", "href"]):
+                    with open(filename, "r") as infile:
+                        self.assertEqual(
+                            utils.parse_text_stream(infile, attributes=attributes),
+                            utils.parse_text(html, attributes=attributes),
+                        )
+
+    def test_xpath_keeps_only_current_match(self):
+        rows = "".join(
+            '<tr class="{0}"><td>row {1}</td></tr>'.format("odd" * (i % 2), i)
+            for i in range(1000)
+        )
+        raw_html = "<html><body><table>{0}</table></body></html>".format(rows)
+        chunks = [raw_html[i : i + 100] for i in range(0, len(raw_html), 100)]
+        matches = []
+        for elem in iter_xpath_matches(chunks, "//tr[@class='odd']"):
+            # Ancestors, the match, and at most a chunk of parsed-ahead rows
+            self.assertLess(len(elem.getroottree().xpath("//*")), 20)
+            matches.append(elem.xpath("string()"))
+        self.assertEqual(matches, ["row {0}".format(i) for i in range(1, 1000, 2)])
+
+    def test_xpath_must_select_elements(self):
+        with self.assertRaises(ValueError):
+            list(iter_xpath_matches(["<p>text</p>"], "//p/text()"))
+
+    def test_xpath_yields_outermost_of_nested_matches(self):
+        raw_html = (
+            '<html><body><div id="a"><div id="b"><div id="c"></div></div></div>'
+            '<p><div id="d"></div></p></body></html>'
+        )
+        html = lxml.html.fromstring(raw_html)
+        matches = html.xpath("//div")
+        outermost = [
+            x.get("id")
+            for x in matches
+            if not any(y in matches for y in x.iterancestors())
+        ]
+        streamed = [x.get("id") for x in iter_xpath_matches([raw_html], "//div")]
+        self.assertEqual(streamed, outermost)
+        self.assertEqual(streamed, ["a", "d"])
+
+    def test_streamed_page_is_saved_with_xpath(self):
+        base_dir = os.getcwd()
+        work_dir = tempfile.mkdtemp()
+        os.chdir(work_dir)
+        try:
+            parser = scrape.get_parser()
+            args = vars(parser.parse_args(["--html", "-ni", "--stream", "-x", "//p"]))
+            raw_resp = tempfile.TemporaryFile(mode="w+")
+            raw_resp.write("<html><body><p>one</p><div>two</div><p>three</p>")
+            utils.write_part_file(args, "http://example.com", raw_resp)
+            raw_resp.close()
+            self.assertEqual(
+                utils.read_files("PART1.html"), "<p>one</p><p>three</p>"
+            )
+        finally:
+            utils.MANIFESTS.clear()
+            os.chdir(base_dir)
+            shutil.rmtree(work_dir)
+
+
+class ReFilterTestCase(unittest.TestCase):
+    def test_keeps_matches_in_order_once(self):
+        text = ["b2", "a1", "c3", "a1", "b2 a1"]
+        self.assertEqual(utils.re_filter(text, ["a", "b"]), ["b2", "a1", "b2 a1"])
+
+    def test_ignores_empty_matches(self):
+        self.assertEqual(utils.re_filter(["xyz", "xb"], ["a*", "b"]), ["xb"])
+
+    def test_returns_all_text_without_matches(self):
+        self.assertEqual(utils.re_filter(["x", "y"], ["z"]), ["x", "y"])
+
+    def test_compiles_once(self):
+        regex_filter = utils.get_regex_filter(["a", "b"])
+        self.assertIs(utils.get_regex_filter(["a", "b"]), regex_filter)
+
+
+class FrontierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.links = [
+            ("http://a.com/{0}".format(i), "a.com/{0}".format(i)) for i in range(10)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def assert_fifo_once(self, frontier):
+        frontier.update(self.links[:7])
+        self.assertFalse(frontier.add(*self.links[2]))
+        self.assertEqual([frontier.pop() for _ in range(3)], self.links[:3])
+        frontier.update(self.links)  # Popped and queued links are not requeued
+        self.assertEqual(len(frontier), 7)
+        self.assertIn(self.links[0][1], frontier)
+        self.assertEqual([frontier.pop() for _ in range(7)], self.links[3:])
+        self.assertRaises(IndexError, frontier.pop)
+        frontier.close()
+
+    def test_memory_frontier(self):
+        self.assert_fifo_once(MemoryFrontier())
+
+    def test_sqlite_frontier(self):
+        for batch_size in (1, 3, 100):
+            self.assert_fifo_once(SQLiteFrontier(batch_size=batch_size))
+
+    def test_sqlite_frontier_reopens(self):
+        path = os.path.join(self.work_dir, "frontier.db")
+        frontier = SQLiteFrontier(path, batch_size=3)
+        frontier.update(self.links[:8])
+        self.assertEqual([frontier.pop() for _ in range(4)], self.links[:4])
+        frontier.close()
+
+        frontier = SQLiteFrontier(path, batch_size=3)
+        self.assertFalse(frontier.add(*self.links[0]))
+        frontier.update(self.links)
+        self.assertEqual([frontier.pop() for _ in range(6)], self.links[4:])
+        frontier.close()
+
+    def test_saved_states_only_append_new_parts(self):
+        manifest = PartManifest(self.work_dir)
+        path = os.path.join(self.work_dir, "frontier.db")
+        for frontier in (MemoryFrontier(), SQLiteFrontier(path)):
+            saved_num = 0
+            for num_parts in (2, 3):
+                for _ in range(num_parts):
+                    manifest.new_part("http://a.com/")
+                state = {"manifest": manifest.to_dict(saved_num)}
+                self.assertEqual(len(state["manifest"]["parts"]), num_parts)
+                saved_state = frontier.save_state(state)
+                saved_num = manifest.next_num
+            frontier.close()
+            frontier = frontier_from_dict(saved_state["frontier"])
+            self.assertEqual(
+                frontier.load_state(saved_state)["manifest"], manifest.to_dict()
+            )
+            frontier.close()
+            manifest = PartManifest(self.work_dir)
+
+
+class OrderedSetTestCase(unittest.TestCase):
+    def assert_same_order(self, ordered_set, reference):
+        self.assertEqual(list(ordered_set), list(reference))
+        self.assertEqual(list(reversed(ordered_set)), list(reversed(reference)))
+        self.assertEqual(len(ordered_set), len(reference))
+
+    def test_matches_dict_order(self):
+        rand = random.Random(0)
+        ordered_set, reference = OrderedSet(), {}
+        for _ in range(3000):
+            op, key = rand.random(), rand.randrange(20)
+            if op < 0.3:
+                ordered_set.add(key)
+                reference.setdefault(key)
+            elif op < 0.55:
+                ordered_set.discard(key)
+                reference.pop(key, None)
+            elif op < 0.7:
+                keys = [rand.randrange(20) for _ in range(rand.randrange(5))]
+                ordered_set.update(keys)
+                reference.update((x, None) for x in keys if x not in reference)
+            elif reference:
+                last = op < 0.85
+                key = list(reference)[-1 if last else 0]
+                self.assertEqual(ordered_set.pop(last=last), key)
+                del reference[key]
+            self.assert_same_order(ordered_set, reference)
+        ordered_set.clear()
+        self.assertRaises(KeyError, ordered_set.pop)
+
+    def test_compacts_discarded_keys(self):
+        ordered_set = OrderedSet(range(1000))
+        for key in range(900):
+            ordered_set.discard(key)
+        ordered_set.add(5)
+        self.assertLess(len(ordered_set.order), 200)
+        self.assert_same_order(ordered_set, list(range(900, 1000)) + [5])
+        self.assertEqual(ordered_set.pop(last=False), 900)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache.get("a"), 1)
+        cache["c"] = 3
+        self.assertEqual(list(cache), ["a", "c"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 1, 1))
+
+    def test_page_cache_counts_duplicates(self):
+        parser = scrape.get_parser()
+        args = vars(parser.parse_args(["-all", "-q", "-ni", "-cs", "2"]))
+        crawler = Crawler(args)
+        page = lxml.html.fromstring("<p>Synthetic page</p>")
+        self.assertFalse(crawler.page_crawled(page))
+        self.assertTrue(crawler.page_crawled(page))
+        self.assertEqual((crawler.page_cache.hits, crawler.page_cache.misses), (1, 1))
+
+
+class SimHashTestCase(unittest.TestCase):
+    text = " ".join("word{0}".format(i) for i in range(300))
+
+    def test_near_duplicates_are_close(self):
+        fingerprint = simhash(self.text)
+        near_dup = simhash(self.text.replace("word150", "12:00:01"))
+        other = simhash(" ".join("other{0}".format(i) for i in range(300)))
+        self.assertLessEqual(hamming_distance(fingerprint, near_dup), 3)
+        self.assertGreater(hamming_distance(fingerprint, other), 3)
+
+    def test_index_finds_within_threshold(self):
+        index = SimHashIndex(3, maxsize=2)
+        index.add(0b1111)
+        self.assertIsNone(index.find(0b0000))
+        self.assertEqual(index.find(0b0011 | 1 << 63), 0b1111)
+        index.add(1 << 40)
+        index.add(1 << 20)
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.find(0b1111))
+
+    def test_crawler_skips_near_duplicates(self):
+        parser = scrape.get_parser()
+        args = vars(parser.parse_args(["-all", "-q", "-ni", "-nd", "3"]))
+        crawler = Crawler(args)
+        page = "<p>{0}</p><p>Generated at {1}</p>"
+        first = lxml.html.fromstring(page.format(self.text, "12:00:00"))
+        second = lxml.html.fromstring(page.format(self.text, "12:00:01"))
+        self.assertFalse(crawler.page_crawled(first))
+        self.assertTrue(crawler.page_crawled(second))
+
+    def test_incremental_crawler_skips_near_duplicates_of_unchanged_pages(self):
+        base_dir = os.getcwd()
+        work_dir = tempfile.mkdtemp()
+        os.chdir(work_dir)
+        try:
+            parser = scrape.get_parser()
+            options = ["-all", "-q", "-ni", "-t", "-nd", "3", "--incremental"]
+            args = vars(parser.parse_args(options))
+            page = "<p>{0}</p><p>Generated at {1}</p>"
+            first = page.format(self.text, "12:00:00")
+            second = page.format(self.text, "12:00:01")
+            validators_path = os.path.join(work_dir, "validators.db")
+            for recrawled_page in (None, first, NOT_MODIFIED):
+                crawler = Crawler(args)
+                crawler.validators = ValidatorStore(validators_path)
+                frontier = MemoryFrontier()
+                if recrawled_page is None:
+                    # The first crawl records the validators of the page
+                    self.assertTrue(
+                        crawler.process_page("http://a.com/1", first, frontier, "1")
+                    )
+                else:
+                    crawler.response_validators["1"] = (None, None)
+                    crawler.process_page(
+                        "http://a.com/1", recrawled_page, frontier, "1"
+                    )
+                    self.assertEqual(crawler.num_unchanged, 1)
+                    self.assertFalse(
+                        crawler.process_page("http://a.com/2", second, frontier, "2")
+                    )
+                crawler.validators.close()
+        finally:
+            utils.remove_part_files()
+            utils.MANIFESTS.clear()
+            os.chdir(base_dir)
+            shutil.rmtree(work_dir)
+
+
+class HostSchedulerTestCase(unittest.TestCase):
+    def test_rate_limit_per_host(self):
+        scheduler = HostScheduler(rate=20)
+        start = time.time()
+        for _ in range(5):
+            with scheduler.slot("a"):
+                pass
+        self.assertGreaterEqual(time.time() - start, 0.19)
+        start = time.time()
+        with scheduler.slot("b"):
+            pass
+        self.assertLess(time.time() - start, 0.05)
+
+    def test_delay_per_host(self):
+        scheduler = HostScheduler()
+        scheduler.set_delay("a", 0.1)
+        start = time.time()
+        for _ in range(3):
+            with scheduler.slot("a"):
+                pass
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+    def test_concurrency_per_host(self):
+        scheduler = HostScheduler(host_concurrency=2)
+        lock = threading.Lock()
+        active = {"a": 0, "b": 0}
+        max_active = dict(active)
+
+        def request(host):
+            with scheduler.slot(host):
+                with lock:
+                    active[host] += 1
+                    max_active[host] = max(max_active[host], active[host])
+                time.sleep(0.02)
+                with lock:
+                    active[host] -= 1
+
+        threads = [threading.Thread(target=request, args=(host,)) for host in "ab" * 6]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max_active, {"a": 2, "b": 2})
+
+
+class RobotsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_saved_robots_txt_sets_crawl_delay(self):
+        scheduler = HostScheduler()
+        robots = RobotsCache(scheduler, self.cache_dir)
+        with open(robots.get_filename("http://example.com"), "w") as robots_txt:
+            robots_txt.write("User-agent: *\nDisallow: /private\nCrawl-delay: 2\n")
+        self.assertTrue(robots.can_fetch("http://example.com/public"))
+        self.assertFalse(robots.can_fetch("http://example.com/private/page"))
+        self.assertEqual(scheduler.delays, {"example.com": 2})
+
+
+class PageStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = os.path.join(tempfile.mkdtemp(), "pages")
+        self.pages = ["<p>page {0} \u00e9</p>".format(x) * 1000 for x in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.store_dir))
+
+    def test_random_access(self):
+        store = PageStore(self.store_dir, segment_size=1)
+        for num, page in enumerate(self.pages, 1):
+            self.assertGreater(store.put(num, "http://a/{0}".format(num), page), 0)
+        # One segment per page, plus the index
+        self.assertEqual(len(os.listdir(self.store_dir)), len(self.pages) + 1)
+        for num in (3, 1, 5):
+            self.assertEqual(store.get(num), self.pages[num - 1])
+        with store.open(2) as infile:
+            self.assertEqual(infile.read(), self.pages[1])
+        store.close()
+
+    def test_identical_pages_stored_once(self):
+        store = PageStore(self.store_dir)
+        page = self.pages[0]
+        self.assertGreater(store.put(1, "http://a/1", [page[:10], page[10:]]), 0)
+        segment_size = store.segment.tell()
+        with tempfile.TemporaryFile(mode="w+") as infile:
+            infile.write(page)
+            self.assertEqual(store.put(2, "http://a/2", infile), 0)
+        self.assertEqual(store.put(1, "http://a/1", page), 0)
+        self.assertEqual(store.segment.tell(), segment_size)
+        store.remove(1)
+        self.assertEqual(store.get(2), page)
+        # Once no part has the page, storing it again writes it again
+        store.remove(2)
+        self.assertGreater(store.put(3, "http://a/3", page), 0)
+        self.assertEqual(store.get(3), page)
+        store.close()
+
+    def test_reopen(self):
+        store = PageStore(self.store_dir)
+        for num, page in enumerate(self.pages, 1):
+            store.put(num, "http://a/{0}".format(num), page)
+        store.remove(2)
+        store.close()
+
+        store = PageStore(self.store_dir)
+        self.assertEqual(len(store), 4)
+        self.assertNotIn(2, store)
+        self.assertEqual(store.get(5), self.pages[4])
+        store.put(6, "http://a/6", "new page")
+        self.assertEqual(store.get(6), "new page")
+        store.destroy()
+        self.assertFalse(os.path.exists(self.store_dir))
+
+    def test_lookup_by_url_and_fingerprint(self):
+        store = PageStore(self.store_dir)
+        store.put(1, "http://a/1", self.pages[0])
+        store.put(2, "http://a/2", self.pages[0])
+        store.put(3, "http://a/1", self.pages[1])
+        fingerprint = hashlib.sha1(self.pages[0].encode("utf-8")).hexdigest()
+        for reopen in (False, True):
+            if reopen:
+                store.close()
+                store = PageStore(self.store_dir)
+            self.assertEqual(store.find_url("http://a/1"), 3)
+            self.assertIsNone(store.find_url("http://a/3"))
+            self.assertEqual(store.find_fingerprint(fingerprint), [1, 2])
+        store.remove(3)
+        store.remove(1)
+        self.assertIsNone(store.find_url("http://a/1"))
+        self.assertEqual(store.find_fingerprint(fingerprint), [2])
+        store.close()
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_backends(self):
+        body = b"<p>cached page</p>" * 100
+        for backend in cache.BACKENDS:
+            responses = cache.open_cache(self.cache_dir, backend)
+            self.assertIsNone(responses.get("http://a"))
+            responses.set("http://a", 200, {"Content-Type": "text/html"}, body)
+            self.assertLess(responses.backend.size, len(body) / 10)
+            responses.close()
+
+            # Responses persist across runs
+            responses = cache.open_cache(self.cache_dir, backend)
+            entry = responses.get("http://a")
+            self.assertEqual(entry, (200, {"Content-Type": "text/html"}, body))
+            self.assertEqual((responses.stats.hits, responses.stats.misses), (1, 0))
+            self.assertEqual(responses.stats.bytes_saved, len(body))
+            responses.close()
+
+    def test_ttl(self):
+        for backend in cache.BACKENDS:
+            responses = cache.open_cache(self.cache_dir, backend, ttl=0)
+            responses.set("http://a", 200, {}, b"expired")
+            self.assertIsNone(responses.get("http://a"))
+            self.assertEqual(responses.backend.size, 0)
+            responses.close()
+
+    def test_lru_eviction(self):
+        bodies = {x: os.urandom(1000) for x in "abc"}
+        for backend in cache.BACKENDS:
+            responses = cache.open_cache(self.cache_dir, backend, max_bytes=2500)
+            responses.set("a", 200, {}, bodies["a"])
+            responses.set("b", 200, {}, bodies["b"])
+            time.sleep(0.01)
+            responses.get("a")
+            responses.set("c", 200, {}, bodies["c"])
+            self.assertIsNone(responses.get("b"))
+            for key in "ac":
+                self.assertEqual(responses.get(key)[2], bodies[key])
+            self.assertEqual(responses.stats.evicted, 1)
+            self.assertLessEqual(responses.backend.size, 2500)
+            responses.close()
+
+    def test_sqlite_access_times_written_on_close(self):
+        responses = cache.open_cache(self.cache_dir, max_bytes=2500)
+        for key in "ab":
+            responses.set(key, 200, {}, os.urandom(1000))
+        time.sleep(0.01)
+        responses.get("a")
+        responses.close()
+
+        responses = cache.open_cache(self.cache_dir, max_bytes=2500)
+        responses.set("c", 200, {}, os.urandom(1000))
+        self.assertIsNone(responses.get("b"))
+        self.assertIsNotNone(responses.get("a"))
+        responses.close()
+
+    def test_unwritable_cache_dir_disables_cache(self):
+        cache_file = os.path.join(self.cache_dir, "file")
+        with open(cache_file, "w"):
+            pass
+        with mock.patch.object(
+            utils, "CACHE_DIR", os.path.join(cache_file, "scrape")
+        ), mock.patch("sys.stderr") as stderr:
+            utils.enable_cache()
+        self.assertIsNone(utils.RESPONSE_CACHE)
+        self.assertIn("Failed to enable cache", stderr.write.call_args[0][0])
+
+    def test_command_line_runner_closes_cache(self):
+        responses = cache.open_cache(self.cache_dir, max_bytes=2500)
+        for key in "ab":
+            responses.set(key, 200, {}, os.urandom(1000))
+        responses.close()
+        time.sleep(0.01)
+
+        # A run that only reads from the cache still records what it used
+        argv = ["scrape", "http://example.com", "-t", "-ni"]
+        with mock.patch.object(sys, "argv", argv), mock.patch.object(
+            utils, "CACHE_DIR", self.cache_dir
+        ), mock.patch.dict(os.environ), mock.patch.object(
+            scrape, "scrape", side_effect=lambda args: utils.RESPONSE_CACHE.get("a")
+        ):
+            os.environ.pop("SCRAPE_DISABLE_CACHE", None)
+            scrape.command_line_runner()
+        self.assertIsNone(utils.RESPONSE_CACHE)
+
+        responses = cache.open_cache(self.cache_dir, max_bytes=2500)
+        responses.set("c", 200, {}, os.urandom(1000))
+        self.assertIsNone(responses.get("b"))
+        self.assertIsNotNone(responses.get("a"))
+        responses.close()
+
+
+class LocalSiteTestCase(unittest.TestCase):
+    num_pages = 40
+
+    @classmethod
+    def setUpClass(cls):
+        cls.site_dir = tempfile.mkdtemp()
+        write_site(cls.site_dir, cls.num_pages)
+        write_images(cls.site_dir, 3)
+        with open(os.path.join(cls.site_dir, "robots.txt"), "w") as robots_txt:
+            robots_txt.write("User-agent: *\nDisallow: /page3.html\n")
+        cls.server = start_server(cls.site_dir)
+        cls.seed_url = "http://127.0.0.1:{0}/page1.html".format(
+            cls.server.server_address[1]
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.site_dir)
+
+    def setUp(self):
+        self.base_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        os.chdir(self.base_dir)
+        shutil.rmtree(self.work_dir)
+
+    def crawl(self, *options):
+        parser = scrape.get_parser()
+        args = vars(parser.parse_args(["-all", "-q", "-ni"] + list(options)))
+        return Crawler(args).crawl_links(self.seed_url)
+
+    def crawled_pages(self, part_filenames):
+        pages = []
+        for filename in part_filenames:
+            text = utils.read_files(filename)
+            pages.append(text[text.index("Synthetic page") :].split("<")[0])
+        return pages
+
+    def page_url(self, num):
+        return self.seed_url.replace("page1.html", "page{0}.html".format(num))
+
+    def test_get_raw_resps_in_parallel(self):
+        page_nums = (3, 1, 2, 1)
+        urls = [self.page_url(x) for x in page_nums]
+        raw_resps = utils.get_raw_resps(urls, workers=4)
+        self.assertEqual(list(raw_resps), urls[:3])
+        for num, url in zip(page_nums, urls):
+            self.assertIn("Synthetic page {0}<".format(num), raw_resps[url])
+
+    def test_session_reuses_connections(self):
+        stats = utils.init_session(pool_size=2).stats
+        for num in range(1, 6):
+            utils.get_raw_resp(self.page_url(num))
+        self.assertEqual(stats.requests, 5)
+        self.assertEqual(stats.opened, 1)
+        self.assertEqual(stats.reused, 4)
+
+    def test_session_serves_cached_responses(self):
+        utils.RESPONSE_CACHE = cache.open_cache(self.work_dir, "filesystem")
+        try:
+            stats = utils.init_session().stats
+            first = utils.get_raw_resp(self.page_url(1))
+            self.assertEqual(utils.get_raw_resp(self.page_url(1)), first)
+            streamed = utils.stream_raw_resp(self.page_url(1))
+            self.assertEqual(streamed.read(), first)
+            # Conditional requests go to the server
+            utils.get_modified_resp(self.page_url(1), etag='"x"')
+            self.assertEqual(stats.requests, 2)
+            self.assertEqual(utils.RESPONSE_CACHE.stats.hits, 2)
+        finally:
+            utils.RESPONSE_CACHE = None
+            utils.init_session()
+
+    def test_write_part_images_once_per_url(self):
+        raw_html = (
+            '<html><body><img src="/img/0.png"><img src="img/1.png">'
+            '<img src="/img/0.png"><img src="/img/missing.png"></body></html>'
+        )
+        stats = utils.init_session().stats
+        raw_html = utils.write_part_images(
+            self.seed_url, raw_html, lxml.html.fromstring(raw_html), "PART1.html"
+        )
+        self.assertEqual(stats.requests, 3)
+        for i in range(2):
+            img_name = os.path.join("PART1_files", "{0}.png".format(i))
+            self.assertIn('src="{0}"'.format(img_name), raw_html)
+            self.assertEqual(utils.read_files(img_name), "image {0}".format(i))
+        self.assertIn('src="/img/missing.png"', raw_html)
+
+    def test_write_part_images_same_name(self):
+        icons_dir = os.path.join(self.site_dir, "icons")
+        os.makedirs(icons_dir)
+        try:
+            with open(os.path.join(icons_dir, "0.png"), "wb") as img:
+                img.write(b"icon 0")
+            raw_html = (
+                '<html><body><img src="/img/0.png"><img src="/icons/0.png">'
+                "</body></html>"
+            )
+            raw_html = utils.write_part_images(
+                self.seed_url, raw_html, lxml.html.fromstring(raw_html), "PART1.html"
+            )
+        finally:
+            shutil.rmtree(icons_dir)
+        img_name = os.path.join("PART1_files", "0.png")
+        icon_name = os.path.join("PART1_files", "0 (2).png")
+        self.assertIn('src="{0}"'.format(img_name), raw_html)
+        self.assertIn('src="{0}"'.format(icon_name), raw_html)
+        self.assertEqual(utils.read_files(img_name), "image 0")
+        self.assertEqual(utils.read_files(icon_name), "icon 0")
+
+    def test_serial_crawl(self):
+        filenames = self.crawl()
+        self.assertEqual(len(filenames), self.num_pages)
+
+    def test_concurrent_crawl_matches_serial(self):
+        serial_pages = self.crawled_pages(self.crawl())
+        utils.remove_part_files()
+        concurrent_pages = self.crawled_pages(self.crawl("--concurrency", "8"))
+        self.assertEqual(concurrent_pages, serial_pages)
+
+    def crawl_to_text(self, **options):
+        parser = scrape.get_parser()
+        args = vars(parser.parse_args(["-all", "-q", "-ni", "-t", "-ow", "-s"]))
+        args.update(options)
+        args["files"], args["urls"] = [], [self.seed_url]
+        filenames = Crawler(args).crawl_links(self.seed_url)
+        self.assertEqual(len(filenames), self.num_pages)
+        num_files_on_disk = len(os.listdir(os.getcwd()))
+        scrape.write_files(args, filenames, "site")
+        self.assertIn("Synthetic page 40", utils.read_files("site.txt"))
+        self.assertEqual(utils.get_num_part_files(), 0)
+        self.assertEqual(os.listdir(os.getcwd()), ["site.txt"])
+        return num_files_on_disk
+
+    def test_crawl_to_text_builds_no_dom(self):
+        prev_parse_count = utils.PARSE_COUNT
+        self.crawl_to_text()
+        self.assertEqual(utils.PARSE_COUNT - prev_parse_count, 0)
+
+    def test_crawl_to_text_in_memory(self):
+        self.assertEqual(self.crawl_to_text(), 0)
+
+    def test_crawl_to_text_spills_to_disk(self):
+        self.assertEqual(self.crawl_to_text(max_memory=0), self.num_pages)
+
+    def test_sqlite_frontier_crawl_matches_memory(self):
+        memory_pages = self.crawled_pages(self.crawl())
+        utils.remove_part_files()
+        sqlite_pages = self.crawled_pages(self.crawl("--frontier", "sqlite"))
+        self.assertEqual(sqlite_pages, memory_pages)
+        self.assertEqual(len(sqlite_pages), self.num_pages)
+
+    def test_stream_crawl_matches_serial(self):
+        serial_pages = self.crawled_pages(self.crawl())
+        utils.remove_part_files()
+        stream_pages = self.crawled_pages(self.crawl("--stream"))
+        self.assertEqual(stream_pages, serial_pages)
+
+    def test_page_store_crawl_to_text(self):
+        self.crawl_to_text(max_memory=0)
+        text = utils.read_files("site.txt")
+        os.remove("site.txt")
+        self.assertEqual(self.crawl_to_text(max_memory=0, page_store=True), 1)
+        self.assertEqual(utils.read_files("site.txt"), text)
+        os.remove("site.txt")
+        self.crawl_to_text(max_memory=0, page_store=True, stream=True)
+        self.assertEqual(utils.read_files("site.txt"), text)
+
+    def test_stored_pages_as_files(self):
+        filenames = self.crawl("--page-store")
+        with utils.stored_pages_as_files(filenames) as infilenames:
+            self.assertEqual(len(infilenames), self.num_pages)
+            for filename, infilename in zip(filenames, infilenames):
+                with open(infilename, "r") as infile:
+                    self.assertEqual(infile.read(), utils.read_files(filename))
+        self.assertFalse(any(os.path.exists(x) for x in infilenames))
+        utils.remove_part_files()
+
+    def test_remove_part_files_keeps_page_store_of_another_run(self):
+        store = PageStore(os.path.join(os.getcwd(), utils.PAGE_STORE_DIRNAME))
+        store.put(1, self.seed_url, "<p>kept</p>")
+        store.close()
+        filenames = self.crawl("-max", "2")
+        self.assertEqual(len(filenames), 2)
+        utils.remove_part_files()
+        self.assertEqual(os.listdir(os.getcwd()), [utils.PAGE_STORE_DIRNAME])
+        self.assertEqual(len(PageStore(utils.PAGE_STORE_DIRNAME)), 1)
+
+    def test_resumed_page_store_crawl_matches_uninterrupted(self):
+        pages = self.crawled_pages(self.crawl())
+        utils.remove_part_files()
+        resumed_pages = self.crawled_pages(self.interrupt_and_resume("--page-store"))
+        self.assertEqual(resumed_pages, pages)
+        utils.remove_part_files()
+        self.assertEqual(os.listdir(os.getcwd()), [])
+
+    def test_stream_crawl_to_text_spills_to_disk(self):
+        self.crawl_to_text(max_memory=0)
+        text = utils.read_files("site.txt")
+        os.remove("site.txt")
+        self.crawl_to_text(max_memory=0, stream=True, xpath="//body")
+        self.assertEqual(utils.read_files("site.txt"), text)
+
+    def test_manifest_skips_unrelated_part_files(self):
+        utils.write_file(["unrelated"], "PART1.html")
+        filenames = self.crawl("-max", "3")
+        self.assertEqual(filenames, ["PART2.html", "PART3.html", "PART4.html"])
+        part = utils.get_manifest().get("PART2.html")
+        self.assertEqual(part.url, self.seed_url)
+        self.assertEqual(part.size, os.path.getsize("PART2.html"))
+        utils.remove_part_files()
+        self.assertEqual(os.listdir(os.getcwd()), ["PART1.html"])
+
+    def test_pages_without_content_are_not_recorded(self):
+        parser = scrape.get_parser()
+        args = vars(parser.parse_args(["--html", "-ni", "-x", "//span"]))
+        utils.write_part_file(args, "http://example.com", "")
+        page = "<html><body><p>one</p></body></html>"
+        with self.assertRaises(ValueError):
+            utils.write_part_file(args, "http://example.com", page)
+        args["stream"] = True
+        raw_resp = tempfile.TemporaryFile(mode="w+")
+        raw_resp.write(page)
+        with self.assertRaises(ValueError):
+            utils.write_part_file(args, "http://example.com", raw_resp)
+        raw_resp.close()
+        self.assertEqual(len(utils.get_manifest()), 0)
+        self.assertEqual(os.listdir(os.getcwd()), [])
+
+    def interrupt_and_resume(self, *options):
+        parser = scrape.get_parser()
+        options = ["-all", "-q", "-ni", "--checkpoint-interval", "4"] + list(options)
+        args = vars(parser.parse_args(options))
+        fetched = []
+        interrupt_after = [10]  # Pages fetched before the crawl is interrupted
+
+        def fetch(url):
+            if len(fetched) == interrupt_after[0]:
+                raise KeyboardInterrupt
+            fetched.append(url)
+            return utils.get_raw_resp(url)
+
+        crawler = Crawler(args)
+        crawler.fetch = fetch
+        with self.assertRaises(KeyboardInterrupt):
+            crawler.crawl_links(self.seed_url)
+        self.assertTrue(os.path.exists(crawler.state_path))
+
+        utils.MANIFESTS.clear()  # As if resumed by a new process
+        for store in utils.PAGE_STORES.values():
+            store.close()
+        utils.PAGE_STORES.clear()
+        args["resume"] = True
+        crawler = Crawler(args)
+        crawler.fetch = fetch
+        interrupt_after[0] = None
+        filenames = crawler.crawl_links(self.seed_url)
+        self.assertEqual(sorted(fetched), sorted(set(fetched)))
+        self.assertEqual(len(fetched), self.num_pages)
+        self.assertFalse(os.path.exists(crawler.state_path))
+        return filenames
+
+    def kill_and_resume(self, *options):
+        options = ["-all", "-q", "-ni", "--checkpoint-interval", "4"] + list(options)
+        # Kill the crawl after 10 pages, between checkpoints, so that neither
+        # the interrupt handler nor any finally clause runs
+        code = (
+            "import os, sys\n"
+            "from scrape import scrape, utils\n"
+            "from scrape.crawler import Crawler\n"
+            "args = vars(scrape.get_parser().parse_args(sys.argv[2:]))\n"
+            "fetched = []\n"
+            "def fetch(url):\n"
+            "    if len(fetched) == 10:\n"
+            "        os._exit(1)\n"
+            "    fetched.append(url)\n"
+            "    return utils.get_raw_resp(url)\n"
+            "crawler = Crawler(args)\n"
+            "crawler.fetch = fetch\n"
+            "crawler.crawl_links(sys.argv[1])\n"
+        )
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(scrape_package.__file__))
+        proc = subprocess.run(
+            [sys.executable, "-c", code, self.seed_url] + options,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            env=env,
+        )
+        self.assertEqual(proc.returncode, 1, proc.stderr)
+        state_filename = checkpoint.get_state_filename(self.seed_url)
+        self.assertTrue(os.path.exists(state_filename))
+
+        args = vars(scrape.get_parser().parse_args(options + ["--resume"]))
+        crawler = Crawler(args)
+        fetched = []
+
+        def fetch(url):
+            fetched.append(url)
+            return utils.get_raw_resp(url)
+
+        crawler.fetch = fetch
+        filenames = crawler.crawl_links(self.seed_url)
+        # Pages after the last checkpoint are crawled again, and no others
+        self.assertEqual(sorted(fetched), sorted(set(fetched)))
+        self.assertEqual(len(fetched), self.num_pages - 8)
+        self.assertFalse(os.path.exists(crawler.state_path))
+        part_files = [x for x in os.listdir(os.getcwd()) if x.startswith("PART")]
+        self.assertEqual(len(part_files), self.num_pages)
+        return filenames
+
+    def test_killed_crawl_resumes_from_last_checkpoint(self):
+        pages = self.crawled_pages(self.crawl())
+        utils.remove_part_files()
+        for frontier in ("memory", "sqlite"):
+            resumed_pages = self.crawled_pages(
+                self.kill_and_resume("--frontier", frontier)
+            )
+            self.assertEqual(resumed_pages, pages)
+            utils.remove_part_files()
+
+    def test_resumed_crawl_matches_uninterrupted(self):
+        pages = self.crawled_pages(self.crawl())
+        utils.remove_part_files()
+        resumed_pages = self.crawled_pages(self.interrupt_and_resume())
+        self.assertEqual(resumed_pages, pages)
+
+    def test_resumed_concurrent_sqlite_crawl_matches_uninterrupted(self):
+        pages = self.crawled_pages(self.crawl())
+        utils.remove_part_files()
+        resumed_pages = self.crawled_pages(
+            self.interrupt_and_resume("--concurrency", "4", "--frontier", "sqlite")
+        )
+        self.assertEqual(resumed_pages, pages)
+
+    def test_rate_limited_crawl_matches_serial(self):
+        serial_pages = self.crawled_pages(self.crawl("-max", "10"))
+        utils.remove_part_files()
+        start = time.time()
+        options = ["--concurrency", "4", "--rate", "20", "--host-concurrency", "2"]
+        limited_pages = self.crawled_pages(self.crawl("-max", "10", *options))
+        self.assertGreaterEqual(time.time() - start, 0.4)
+        self.assertEqual(limited_pages, serial_pages)
+
+    def test_robots_crawl_skips_disallowed_pages(self):
+        # Page 3 is disallowed, and with it every page only it links to
+        subtree = {3}
+        for num in range(6, self.num_pages + 1):
+            if num // 2 in subtree:
+                subtree.add(num)
+        expected = [x for x in range(1, self.num_pages + 1) if x not in subtree]
+
+        parser = scrape.get_parser()
+        for concurrency in ("1", "4"):
+            options = ["-all", "-q", "-ni", "--robots", "--concurrency", concurrency]
+            crawler = Crawler(vars(parser.parse_args(options)))
+            crawler.robots.cache_dir = os.path.join(self.work_dir, concurrency)
+            self.server.user_agents.clear()
+            pages = self.crawled_pages(crawler.crawl_links(self.seed_url))
+            self.assertEqual(pages, ["Synthetic page {0}".format(x) for x in expected])
+            self.assertEqual(self.server.user_agents["/robots.txt"], "scrape")
+            self.assertNotIn("/page3.html", self.server.user_agents)
+            utils.remove_part_files()
+
+        # robots.txt is read from disk by later crawls
+        stats = utils.init_session().stats
+        robots = RobotsCache(cache_dir=crawler.robots.cache_dir)
+        self.assertFalse(robots.can_fetch(self.page_url(3)))
+        self.assertEqual(stats.requests, 0)
+
+    def crawl_incrementally(self, *options):
+        parser = scrape.get_parser()
+        options = ["-all", "-q", "-ni", "--incremental"] + list(options)
+        args = vars(parser.parse_args(options))
+        crawler = Crawler(args)
+        crawler.validators_path = os.path.join(self.work_dir, "validators.db")
+        filenames = crawler.crawl_links(self.seed_url)
+        pages = self.crawled_pages(filenames)
+        utils.remove_part_files()
+        return pages, crawler.num_unchanged
+
+    def test_incremental_crawl_skips_unchanged_pages(self):
+        pages, num_unchanged = self.crawl_incrementally()
+        self.assertEqual((len(pages), num_unchanged), (self.num_pages, 0))
+        # Every page is answered 304 Not Modified
+        self.assertEqual(self.crawl_incrementally(), ([], self.num_pages))
+
+        page5 = os.path.join(self.site_dir, "page5.html")
+        page7 = os.path.join(self.site_dir, "page7.html")
+        try:
+            # A newer page with the same text is unchanged by its fingerprint
+            os.utime(page7, (time.time() + 10, time.time() + 10))
+            with open(page5, "r") as page:
+                text = page.read()
+            with open(page5, "w") as page:
+                page.write(text.replace("Synthetic page 5", "Synthetic page 5!"))
+            os.utime(page5, (time.time() + 10, time.time() + 10))
+            pages, num_unchanged = self.crawl_incrementally("--concurrency", "4")
+            self.assertEqual(pages, ["Synthetic page 5!"])
+            self.assertEqual(num_unchanged, self.num_pages - 1)
+        finally:
+            write_site(self.site_dir, self.num_pages)
+
+    def test_incremental_crawl_fetches_not_modified_page_without_validators(self):
+        def get_modified_resp(url, etag=None, last_modified=None, stream=False):
+            return None, etag, last_modified  # 304 Not Modified
+
+        with mock.patch.object(utils, "get_modified_resp", get_modified_resp):
+            pages, num_unchanged = self.crawl_incrementally()
+        self.assertEqual((len(pages), num_unchanged), (self.num_pages, 0))
+
+    def test_incremental_crawl_saves_page_that_failed_to_save(self):
+        write_part_file = utils.write_part_file
+
+        def fail_on_page5(args, url, *rest, **kwargs):
+            if url == self.page_url(5):
+                raise IOError("Disk full")
+            return write_part_file(args, url, *rest, **kwargs)
+
+        with mock.patch.object(utils, "write_part_file", fail_on_page5):
+            with self.assertRaises(IOError):
+                self.crawl_incrementally()
+        utils.remove_part_files()
+        pages, num_unchanged = self.crawl_incrementally()
+        self.assertEqual(pages[0], "Synthetic page 5")
+        self.assertEqual(num_unchanged, 4)
+
+    def test_concurrent_crawl_max_crawls(self):
+        filenames = self.crawl("--concurrency", "8", "-max", "5")
+        self.assertEqual(len(filenames), 5)
+
+
 if __name__ == "__main__":
     unittest.main()